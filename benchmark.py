@@ -0,0 +1,310 @@
+import sys
+import os
+import json
+import time
+import random
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from xml.sax.saxutils import escape
+
+import findTags2
+import topicRules
+import languageDetection
+import rowSinks
+
+# generates a reproducible corpus of decks, documents and PDFs and times each stage of findTags2.py on it
+# the generated files only contain the parts the text extractors read
+
+# phrases the topic rules look for, mixed into the filler text
+keywords = [
+    "IP strategy", "licensing agreement", "patent landscape", "patent valuation", "T 1234/12", "G 2/92",
+    "classification", "Art. 123 EPC", "amendments", "Art. 19(2) PCT", "Art. 84 EPC", "clarity", "Art. 6 PCT",
+    "Art. 53 EPC", "Rule 28", "exclusions from patentability", "ordre public", "Art. 56 EPC", "inventive step",
+    "Art. 33(3) PCT", "Art. 54 EPC", "novelty", "Rule 33.1(a) PCT", "Art. 87 EPC", "priority", "state of the art",
+    "Art. 8 PCT", "Art. 83 EPC", "sufficiency of disclosure", "Art. 5 PCT", "Art. 82 EPC", "unity of invention",
+    "Art. 13.1 PCT", "chapter II", "national phase", "USPTO", "litigation", "infringement", "enforcement",
+    "revocation", "EQE", "diversity and inclusion", "GDPR", "data protection", "well-being", "mental health",
+    "exercise", "case study", "cheat sheet", "mock exam", "2019"]
+filler = ("the of and a to in is for that with on as by this be are from at an or which claim claims application "
+          "applicant invention method device system example embodiment figure description prior document step "
+          "feature features feature technical problem solution skilled person office examiner board appeal").split()
+
+def sentence(rng):
+    words = [rng.choice(keywords) if rng.random() < 0.05 else rng.choice(filler) for _ in range(rng.randint(8, 25))]
+    return " ".join(words).capitalize() + "."
+
+def zipParts(path, parts):
+    # fixed timestamps, so the same seed gives the same bytes
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts:
+            archive.writestr(zipfile.ZipInfo(name, (1980, 1, 1, 0, 0, 0)), data)
+
+def writeDeck(path, slideCount, rng):
+    ns = ('xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+          'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+          'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"')
+    parts = [
+        ("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+         '<Default Extension="xml" ContentType="application/xml"/>'
+         '<Override PartName="/ppt/presentation.xml" ContentType="application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml"/>'
+         + "".join('<Override PartName="/ppt/slides/slide%d.xml" ContentType="application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/>' % (i + 1) for i in range(slideCount))
+         + '</Types>'),
+        ("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="ppt/presentation.xml"/></Relationships>'),
+        ("ppt/presentation.xml", '<?xml version="1.0" encoding="UTF-8"?><p:presentation %s><p:sldIdLst>' % ns
+         + "".join('<p:sldId id="%d" r:id="rId%d"/>' % (256 + i, i + 1) for i in range(slideCount))
+         + '</p:sldIdLst></p:presentation>'),
+        ("ppt/_rels/presentation.xml.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         + "".join('<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide" Target="slides/slide%d.xml"/>' % (i + 1, i + 1) for i in range(slideCount))
+         + '</Relationships>'),
+        ]
+    for i in range(slideCount):
+        shapes = []
+        for shapeNumber in range(rng.randint(1, 4)):
+            paragraphs = "".join('<a:p><a:r><a:t>%s</a:t></a:r></a:p>' % escape(sentence(rng)) for _ in range(rng.randint(1, 5)))
+            shapes.append('<p:sp><p:nvSpPr><p:cNvPr id="%d" name="Text %d"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr/>'
+                          '<p:txBody><a:bodyPr/>%s</p:txBody></p:sp>' % (shapeNumber + 2, shapeNumber, paragraphs))
+        parts.append(("ppt/slides/slide%d.xml" % (i + 1), '<?xml version="1.0" encoding="UTF-8"?><p:sld %s><p:cSld><p:spTree>'
+                      '<p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>%s'
+                      '</p:spTree></p:cSld></p:sld>' % (ns, "".join(shapes))))
+    zipParts(path, parts)
+
+def writeDocument(path, paragraphCount, rng):
+    body = "".join('<w:p><w:r><w:t xml:space="preserve">%s</w:t></w:r></w:p>' % escape(" ".join(sentence(rng) for _ in range(rng.randint(1, 4))))
+                   for _ in range(paragraphCount))
+    zipParts(path, [
+        ("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+         '<Default Extension="xml" ContentType="application/xml"/>'
+         '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'),
+        ("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>'),
+        ("word/document.xml", '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+         '<w:body>%s</w:body></w:document>' % body),
+        ])
+
+def writeWorkbook(path, rowCount, rng):
+    # one sheet of inline string cells, a few sentences per row
+    rows = "".join('<row r="%d">%s</row>' % (row + 1, "".join(
+        '<c r="%s%d" t="inlineStr"><is><t>%s</t></is></c>' % ("ABCD"[column], row + 1, escape(sentence(rng)))
+        for column in range(rng.randint(1, 4)))) for row in range(rowCount))
+    zipParts(path, [
+        ("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+         '<Default Extension="xml" ContentType="application/xml"/>'
+         '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+         '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>'),
+        ("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>'),
+        ("xl/workbook.xml", '<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+        ("xl/_rels/workbook.xml.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/></Relationships>'),
+        ("xl/worksheets/sheet1.xml", '<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+         '<sheetData>%s</sheetData></worksheet>' % rows),
+        ])
+
+def pdfString(text):
+    return text.encode("latin-1", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+def writePDF(path, pageCount, rng):
+    # one Helvetica text object per page; objects 1 and 2 are the catalog and the page tree, 3 is the font
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages = []
+    for _ in range(pageCount):
+        lines = [sentence(rng) for _ in range(rng.randint(5, 40))]
+        stream = b"BT /F1 9 Tf 40 800 Td 11 TL\n" + b"".join(b"(" + pdfString(line) + b") Tj T*\n" for line in lines) + b"ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        pages.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % page for page in pages) + b"] /Count %d >>" % len(pages)
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % (number + 1) + obj + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1) + b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+
+writers = {"pptx": writeDeck, "docx": writeDocument, "pdf": writePDF, "xlsx": writeWorkbook}
+
+def generateCorpus(directory, sizes, seed):
+    # one file per format and size, named <format>-<size>.<format>; returns (format, size, path) for each
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for fileFormat, writer in writers.items():
+        for size in sizes:
+            path = os.path.join(directory, "%s-%05d.%s" % (fileFormat, size, fileFormat))
+            writer(path, size, random.Random("%s-%s-%s" % (seed, fileFormat, size)))
+            corpus.append((fileFormat, size, path))
+    return corpus
+
+def timed(function, repeat):
+    # best wall time of repeat calls, and the result of the last one
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def extractor(fileFormat, backend):
+    if fileFormat == "pptx":
+        return lambda path: findTags2.getPowerPointText(path)[0]
+    if fileFormat == "docx":
+        return lambda path: findTags2.getWordText(path)[0]
+    if fileFormat == "xlsx":
+        return lambda path: findTags2.getExcelText(path)[0]
+    return lambda path: findTags2.getPDFText(path, backend=backend)[0]
+
+def startupTimes(repeat):
+    # wall time of a new interpreter importing findTags2, and of a whole run on an empty folder
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "findTags2.py")
+    with tempfile.TemporaryDirectory() as workDirectory:
+        os.mkdir(os.path.join(workDirectory, "outputs"))
+        os.mkdir(os.path.join(workDirectory, "empty"))
+        commands = {"startup-import": [sys.executable, "-c", "import findTags2"],
+                    "startup-empty": [sys.executable, script, "empty"]}
+        environment = dict(os.environ, PYTHONPATH=os.path.dirname(script))
+        for stage, command in commands.items():
+            yield stage, timed(lambda: subprocess.run(command, cwd=workDirectory, env=environment, check=True,
+                                                      stdout=subprocess.DEVNULL), repeat)[0]
+
+def uncached(function):
+    # the language cache would answer every repeat after the first one
+    def call(*args):
+        languageDetection.languageCache.clear()
+        return function(*args)
+    return call
+
+def throttledRead(latency, bandwidth):
+    # stand-in for a network share: every read waits latency seconds plus the transfer of the file at bandwidth bytes/s
+    readFile = findTags2.readFile
+    def read(path):
+        data = readFile(path)
+        time.sleep(latency + len(data) / bandwidth)
+        return data
+    return read
+
+def pipelineTimes(corpus, repeat, latency, bandwidth):
+    # whole corpus through findTags2.Pipeline on the throttled reads: reading alone, one file read then classified
+    # at a time, and reads overlapping the classification with prefetch threads
+    tasks = [(os.path.dirname(path), os.path.basename(path), os.path.getsize(path), None, False) for fileFormat, size, path in corpus]
+    settings = {"pipeline-serial": argparse.Namespace(prefetch=1, queue_depth=1, queue_mb=256),
+                "pipeline-prefetch": argparse.Namespace(prefetch=4, queue_depth=16, queue_mb=256)}
+    readFile = findTags2.readFile
+    findTags2.readFile = throttledRead(latency, bandwidth)
+    try:
+        yield "pipeline-read", len(tasks), timed(lambda: [findTags2.readFile(os.path.join(directory, name))
+                                                          for directory, name, size, stored, hashIt in tasks], repeat)[0]
+        for stage, options in settings.items():
+            yield stage, len(tasks), timed(lambda: list(uncached(findTags2.Pipeline)(None, tasks, options)), repeat)[0]
+    finally:
+        findTags2.readFile = readFile
+
+def runBenchmarks(corpus, repeat, backends, latency, bandwidth):
+    results = []
+
+    def record(stage, fileFormat, size, seconds, units):
+        results.append({"stage": stage, "format": fileFormat, "size": size, "seconds": round(seconds, 6),
+                        "units": units, "unitsPerSecond": round(units / seconds, 1) if seconds else None})
+        print("%-22s %-5s %6d  %9.4fs  %7d units" % (stage, fileFormat, size, seconds, units), file=sys.stderr)
+
+    for stage, seconds in startupTimes(repeat):
+        record(stage, "-", 0, seconds, 0)
+
+    for fileFormat, size, path in corpus:
+        for backend in (backends if fileFormat == "pdf" else [None]):
+            stage = "extract" + ("-" + backend if backend else "")
+            seconds, onlyText = timed(lambda: extractor(fileFormat, backend)(path), repeat)
+            record(stage, fileFormat, size, seconds, len(onlyText))
+        onlyText = list(filter(None, onlyText))
+        seconds, language = timed(lambda: uncached(languageDetection.detectLanguage)(onlyText), repeat)
+        record("language", fileFormat, size, seconds, len(onlyText))
+        seconds, counts = timed(lambda: topicRules.countMatches(onlyText)[0], repeat)
+        record("rules", fileFormat, size, seconds, len(onlyText))
+        seconds, row = timed(lambda: uncached(findTags2.processFile)(os.path.dirname(path), os.path.basename(path)), repeat)
+        record("processFile", fileFormat, size, seconds, len(onlyText))
+
+    # output writing does not depend on the document format: rows like the ones of a classified file
+    for rowCount in sorted({size for fileFormat, size, path in corpus}):
+        fields = row[0]
+        for outputFormat, sinkClass in rowSinks.sinks.items():
+            if not rowSinks.available(outputFormat):
+                continue
+            with tempfile.TemporaryDirectory() as workDirectory:
+                def writeOutput():
+                    sink = sinkClass(os.path.join(workDirectory, "benchmark." + outputFormat), findTags2.content,
+                                     findTags2.numericContent)
+                    for rowNumber in range(rowCount):
+                        sink.writeRow(fields)
+                    sink.close()
+                seconds, _ = timed(writeOutput, repeat)
+            record("output", outputFormat, rowCount, seconds, rowCount)
+
+    for stage, files, seconds in pipelineTimes(corpus, repeat, latency, bandwidth):
+        record(stage, "-", files, seconds, files)
+    return results
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compareResults(basePath, newPath):
+    # prints new/base time ratios for the entries present in both files
+    with open(basePath) as f:
+        base = {(r["stage"], r["format"], r["size"]): r["seconds"] for r in json.load(f)["results"]}
+    with open(newPath) as f:
+        new = json.load(f)["results"]
+    print("%-22s %-5s %6s  %10s %10s  %6s" % ("stage", "fmt", "size", "base s", "new s", "ratio"))
+    for r in new:
+        key = (r["stage"], r["format"], r["size"])
+        if key in base:
+            ratio = r["seconds"] / base[key] if base[key] else float("nan")
+            print("%-22s %-5s %6d  %10.4f %10.4f  %6.2f" % (key + (base[key], r["seconds"], ratio)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the stages of findTags2.py on a generated corpus")
+    parser.add_argument("--sizes", default="10,150,151,1000",
+                        help="comma separated slide/paragraph/page/row counts of the generated files (default: 10,150,151,1000)")
+    parser.add_argument("--seed", default="1", help="seed of the generated text (default: 1)")
+    parser.add_argument("--corpus", metavar="DIR", help="keep the generated corpus in DIR instead of a temporary folder")
+    parser.add_argument("--repeat", type=int, default=3, metavar="N", help="best of N runs for each measure (default: 3)")
+    parser.add_argument("--pdf-backends", default=",".join(sorted(findTags2.pdfBackends)),
+                        help="comma separated PDF backends to time (default: all)")
+    parser.add_argument("--read-latency", type=float, default=20, metavar="MS",
+                        help="latency of each read of the throttled file system used by the pipeline stages (default: 20)")
+    parser.add_argument("--read-mbps", type=float, default=50, metavar="MB",
+                        help="bandwidth of the throttled file system in megabytes per second (default: 50)")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON to FILE instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two JSON result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compareResults(*args.compare)
+        sys.exit()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as temporaryDirectory:
+        corpus = generateCorpus(args.corpus or temporaryDirectory, sizes, args.seed)
+        results = runBenchmarks(corpus, args.repeat, args.pdf_backends.split(","), args.read_latency / 1000,
+                                args.read_mbps * 1e6)
+    report = {"commit": gitCommit(), "python": platform.python_version(), "platform": platform.platform(),
+              "seed": args.seed, "sizes": sizes, "repeat": args.repeat, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
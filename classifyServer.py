@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import math
+import signal
+import time
+import argparse
+import tempfile
+import queue
+import threading
+import collections
+import multiprocessing
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import findTags2
+import isolatedPool
+import languageDetection
+
+# long-running classification service: the worker processes import the libraries and compile the rules once,
+# and every request classifies one file, given by path or uploaded, and answers with its row as JSON
+#
+#   POST /classify  {"path": "/data/deck.pptx"}               classifies a file the server can read
+#   POST /classify?name=deck.pptx  <file content>              classifies the uploaded bytes
+#   GET  /metrics                                              request counts and latencies
+
+# latencies kept for the percentiles of /metrics
+latencyWindow = 1000
+
+
+def warmWorker(options):
+    # initWorker, then the lazy imports and the language detector, so the first request does not pay them
+    findTags2.initWorker(options)
+    import pdfplumber
+    import openpyxl
+    from pdfminer import pdfinterp, converter, layout
+    languageDetection.detectLanguage(["warm up the language detection of this worker"])
+    languageDetection.languageCache.clear()
+
+class WarmWorkers:
+    # warm worker processes (isolatedPool.workerLoop) taking one request at a time; a worker that does not answer
+    # in time is killed and replaced, so that slow files cannot hold every worker
+    # the workers are started by a fork server, not forked from the request threads
+    def __init__(self, jobs, options):
+        self.context = multiprocessing.get_context("forkserver")
+        self.options = options
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.idle = queue.Queue()
+        for _ in range(jobs):
+            self.idle.put(self.start())
+
+    def start(self):
+        process, connection = isolatedPool.startWorker(warmWorker, (self.options,), context=self.context)
+        with self.lock:
+            self.processes.add(process)
+        return process, connection
+
+    def stop(self, process, connection):
+        process.kill()
+        process.join()
+        connection.close()
+        with self.lock:
+            self.processes.discard(process)
+
+    def run(self, timeout, function, *args):
+        # the result of function(*args) in a worker, an isolatedPool.Failure when it failed or its worker died,
+        # or None after timeout seconds, counting the wait for a free worker; the worker has finished or has been
+        # killed when this returns
+        deadline = time.monotonic() + timeout
+        try:
+            process, connection = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        try:
+            connection.send((function, args))
+            if not connection.poll(max(0, deadline - time.monotonic())):
+                result = None
+            else:
+                completed, value = connection.recv()
+                if completed:
+                    self.idle.put((process, connection))
+                    return value
+                result = isolatedPool.Failure(value)
+        except (EOFError, OSError):
+            process.join()
+            result = isolatedPool.Failure("worker exited with code %s" % process.exitcode)
+        # like isolatedPool, a worker is not reused after a failure or a timeout
+        self.stop(process, connection)
+        self.idle.put(self.start())
+        return result
+
+    def shutdown(self):
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            process.kill()
+        for process in processes:
+            process.join()
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = collections.Counter()
+        self.inFlight = 0
+        self.latencies = collections.deque(maxlen=latencyWindow)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {"uptime": round(time.time() - self.started, 1), "inFlight": self.inFlight, **self.counts}
+        if latencies:
+            report["latencyMs"] = {"count": len(latencies), "mean": round(1000 * sum(latencies) / len(latencies), 1),
+                                   "max": round(1000 * latencies[-1], 1)}
+            # nearest rank: the smallest latency with at least percentile % of the latencies at or below it
+            for percentile in (50, 95, 99):
+                rank = max(1, math.ceil(len(latencies) * percentile / 100))
+                report["latencyMs"]["p%d" % percentile] = round(1000 * latencies[rank - 1], 1)
+        return report
+
+class ClassifyHandler(BaseHTTPRequestHandler):
+    # the server attributes workers, slots, metrics, requestTimeout and maxUpload are set in main
+
+    def sendJSON(self, status, body, headers=()):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/metrics":
+            return self.sendJSON(404, {"error": "unknown path"})
+        self.sendJSON(200, self.server.metrics.report())
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/classify":
+            return self.sendJSON(404, {"error": "unknown path"})
+        metrics = self.server.metrics
+        length = int(self.headers.get("Content-Length", 0))
+        # refused before the body is read, so that the refused requests do not hold their upload in memory
+        if length > self.server.maxUpload:
+            metrics.count("tooLarge")
+            self.close_connection = True
+            return self.sendJSON(413, {"error": "body larger than %d bytes" % self.server.maxUpload})
+        # requests above the concurrency limit are refused at once rather than queued
+        if not self.server.slots.acquire(blocking=False):
+            metrics.count("rejected")
+            self.close_connection = True
+            return self.sendJSON(503, {"error": "too many requests"}, [("Retry-After", "1")])
+        try:
+            body = self.rfile.read(length)
+            start = time.perf_counter()
+            with metrics.lock:
+                metrics.inFlight += 1
+            try:
+                status, answer = self.classify(url, body)
+            finally:
+                with metrics.lock:
+                    metrics.inFlight -= 1
+        finally:
+            self.server.slots.release()
+        seconds = time.perf_counter() - start
+        with metrics.lock:
+            metrics.counts["requests"] += 1
+            metrics.counts["status%d" % status] += 1
+            metrics.latencies.append(seconds)
+        answer["seconds"] = round(seconds, 4)
+        self.sendJSON(status, answer)
+
+    def classify(self, url, body):
+        # returns the HTTP status and the JSON answer
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                path = json.loads(body)["path"]
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "expected {\"path\": ...}"}
+            if not os.path.isfile(path):
+                return 404, {"error": "no such file: %s" % path}
+            return self.run(os.path.dirname(path), os.path.basename(path))
+        name = os.path.basename(urllib.parse.parse_qs(url.query).get("name", [""])[0])
+        if not name:
+            return 400, {"error": "the name of an uploaded file is given with ?name="}
+        # removed once the worker has finished with the file or has been killed
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(body)
+            return self.run(directory, name)
+
+    def run(self, directory, name):
+        result = self.server.workers.run(self.server.requestTimeout, findTags2.processFile, directory, name)
+        if result is None:
+            return 504, {"error": "no answer after %g s" % self.server.requestTimeout}
+        if isinstance(result, isolatedPool.Failure):
+            return 500, {"error": result.reason}
+        fields, useful, info = result
+        return 200, {"row": dict(zip(findTags2.content, fields)), "useful": useful}
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # the clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the classification of single files over HTTP")
+    parser.add_argument("--socket", metavar="PATH", help="listen on a Unix domain socket instead of a TCP port")
+    parser.add_argument("--port", type=int, default=8765, help="localhost TCP port (default: 8765)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), metavar="N",
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--max-requests", type=int, metavar="N",
+                        help="requests classified or waiting at the same time, more are refused with 503 "
+                             "(default: twice the workers)")
+    parser.add_argument("--request-timeout", type=float, default=60, metavar="S",
+                        help="answer 504 when a file takes longer than S seconds, and replace the worker classifying it "
+                             "(default: 60)")
+    parser.add_argument("--max-upload", type=int, default=200, metavar="MB",
+                        help="refuse request bodies larger than MB megabytes with 413 (default: 200)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    findTags2.addClassificationOptions(parser)
+    parser.set_defaults(incremental=False, profile=False, save_hits=False)
+    args = parser.parse_args()
+
+    if args.socket:
+        server = UnixHTTPServer(args.socket, ClassifyHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), ClassifyHandler)
+    server.workers = WarmWorkers(args.jobs, args)
+    server.slots = threading.BoundedSemaphore(args.max_requests or 2 * args.jobs)
+    server.metrics = Metrics()
+    server.requestTimeout = args.request_timeout
+    server.maxUpload = args.max_upload * 1000000
+    server.verbose = args.verbose
+    print("classifying on %s with %d workers" % (args.socket or "http://127.0.0.1:%d" % args.port, args.jobs))
+    # stops the workers also when the service is terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.workers.shutdown()
@@ -0,0 +1,242 @@
+import os
+import csv
+import sys
+import time
+import argparse
+import collections
+import concurrent.futures
+from fractions import Fraction
+
+import findTags2
+import topicRules
+
+# measures the topic decision and the patent law references of findTags2.py against a labelled set, for many
+# settings at once: the rule counts of the labelled files are computed once, from the files or from the hit
+# matrices saved with --save-hits, then each threshold and dominance value is applied in memory
+#
+# the labels are a CSV file with a row per file and the columns file, topic and patentLawRef (or the workbook
+# columns File name, Topic and Patent law ref, so a corrected output can be used); a topic is given by its name,
+# with or without the id, and an empty topic is not evaluated; the references are written as in the workbook,
+# and an empty cell means that none is expected
+
+# predicted topics that are not in findTags2.topics
+noText = ""
+tie = " "
+
+# the references of each concept, EPC then PCT, in the order of the hit matrix columns
+referenceGroups = [(name + suffix, refs) for name, epc, general, pct, epcRef, pctRef in topicRules.conceptRules
+                   for suffix, refs in (("_epc", epcRef), ("_pct", pctRef))]
+referenceGroup = {ref.strip(): group for group, (name, refs) in enumerate(referenceGroups)
+                  for ref in refs.split(";") if ref.strip()}
+
+
+def topicLabels():
+    # the topics by name and by name|id, lowercased
+    labels = {}
+    for topic in findTags2.topics + [findTags2.genericTopic]:
+        labels[topic.lower()] = topic
+        labels[topic.split("|")[0].strip().lower()] = topic
+    return labels
+
+def column(header, *names):
+    for name in names:
+        if name in header:
+            return name
+    return None
+
+def loadLabels(labelsPath):
+    # returns a list of (file, expected topic or None, set of expected reference groups or None)
+    labels = topicLabels()
+    with open(labelsPath, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fileColumn = column(reader.fieldnames, "file", "File name")
+        topicColumn = column(reader.fieldnames, "topic", "Topic")
+        refColumn = column(reader.fieldnames, "patentLawRef", "Patent law ref")
+        if not fileColumn or not (topicColumn or refColumn):
+            sys.exit("%s: expected the columns file and topic and/or patentLawRef" % labelsPath)
+        rows = []
+        for line, row in enumerate(reader, 2):
+            topic = (row[topicColumn] or "").strip() if topicColumn else ""
+            if topic and topic.lower() not in labels:
+                sys.exit("%s:%d: unknown topic %r" % (labelsPath, line, topic))
+            refs = None
+            if refColumn:
+                refs = set()
+                for ref in (row[refColumn] or "").split(";"):
+                    if ref.strip() and ref.strip() not in referenceGroup:
+                        sys.exit("%s:%d: unknown patent law reference %r" % (labelsPath, line, ref.strip()))
+                    if ref.strip():
+                        refs.add(referenceGroup[ref.strip()])
+            rows.append((row[fileColumn], labels[topic.lower()] if topic else None, refs))
+    return rows
+
+def countsFromHits(hitsPaths, names):
+    # the hit matrices of the labelled files, found by file name in the hits files
+    found = {}
+    for hitsPath in hitsPaths:
+        for name, fileHits in findTags2.loadHits(hitsPath).items():
+            if name in found:
+                sys.exit("%s is in more than one hits file" % name)
+            found[name] = fileHits
+    return [found.get(os.path.basename(name)) for name in names]
+
+def classifyHits(path):
+    fields, useful, info = findTags2.processFile(os.path.dirname(path), os.path.basename(path))
+    return info.get("hits")
+
+def countsFromFiles(paths, options):
+    # classifies the labelled files once, keeping their hit matrices
+    if options.jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs, initializer=findTags2.initWorker,
+                                                    initargs=(options,)) as executor:
+            return list(executor.map(classifyHits, paths))
+    findTags2.initWorker(options)
+    return [classifyHits(path) for path in paths]
+
+def ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+def topicMetrics(expected, predicted):
+    # per topic true positives, false positives, false negatives, precision and recall, and the confusion counts
+    confusion = collections.Counter(zip(expected, predicted))
+    metrics = {}
+    for topic in sorted(set(expected) | set(predicted)):
+        tp = confusion[topic, topic]
+        fp = sum(count for (e, p), count in confusion.items() if p == topic and e != topic)
+        fn = sum(count for (e, p), count in confusion.items() if e == topic and p != topic)
+        metrics[topic] = (tp, fp, fn, ratio(tp, tp + fp), ratio(tp, tp + fn))
+    return metrics, confusion
+
+def referenceMetrics(expected, predicted):
+    # per reference group counts, precision and recall from the files × groups bool arrays
+    tp = (expected & predicted).sum(axis=0)
+    fp = (~expected & predicted).sum(axis=0)
+    fn = (expected & ~predicted).sum(axis=0)
+    return [(int(a), int(b), int(c), ratio(a, a + b), ratio(a, a + c)) for a, b, c in zip(tp, fp, fn)]
+
+def parseThresholds(text):
+    # comma separated integers and ranges: 0-10,15
+    thresholds = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        thresholds.extend(range(int(first), int(last or first) + 1))
+    return thresholds
+
+def formatRatio(value):
+    return "%.3f" % value if value is not None else ""
+
+def evaluate(rows, fileHits, thresholds, dominances, outputPrefix):
+    import numpy
+    topicFiles = [i for i, (name, topic, refs) in enumerate(rows) if topic]
+    refFiles = [i for i, (name, topic, refs) in enumerate(rows) if refs is not None]
+
+    # everything that does not depend on the settings: topic columns, title concepts and reference counts
+    topicCounts = numpy.array([hits.sum(axis=0) if hits is not None else numpy.zeros(len(topicRules.topicIndexes), dtype=int)
+                               for hits, titleMatches in (found or (None, None) for found in fileHits)])
+    values = [topicRules.topicColumns(counts, findTags2.thresholdMatches)[0] for counts in topicCounts]
+    groupCounts = topicCounts[:, [topicRules.topicNames.index(name) for name, refs in referenceGroups]]
+    expectedRefs = numpy.zeros((len(refFiles), len(referenceGroups)), dtype=bool)
+    for row, i in enumerate(refFiles):
+        expectedRefs[row, list(rows[i][2])] = True
+
+    topicResults = {}
+    for dominance in dominances:
+        predicted = [findTags2.decideTopic(values[i], fileHits[i][1], float(1 / dominance)) if fileHits[i] else noText
+                     for i in topicFiles]
+        topicResults[dominance] = topicMetrics([rows[i][1] for i in topicFiles], predicted)
+    refResults = {threshold: referenceMetrics(expectedRefs, groupCounts[refFiles] > threshold) for threshold in thresholds}
+
+    settings = []
+    for threshold in thresholds:
+        for dominance in dominances:
+            metrics, confusion = topicResults[dominance]
+            labelled = [metrics[topic] for topic in metrics if topic not in (noText, tie)]
+            tp, fp, fn = (sum(counts[k] for counts in refResults[threshold]) for k in range(3))
+            precision, recall = ratio(tp, tp + fp), ratio(tp, tp + fn)
+            settings.append({
+                "threshold": threshold, "dominance": str(dominance),
+                "topic accuracy": ratio(sum(count for (e, p), count in confusion.items() if e == p), len(topicFiles)),
+                "topic precision": ratio(sum(m[3] or 0 for m in labelled), len(labelled)),
+                "topic recall": ratio(sum(m[4] or 0 for m in labelled), len(labelled)),
+                "reference precision": precision, "reference recall": recall,
+                "reference f1": ratio(2 * precision * recall, precision + recall) if precision and recall else None})
+
+    with open(outputPrefix + ".settings.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(settings[0]))
+        for setting in settings:
+            writer.writerow([formatRatio(value) if isinstance(value, float) or value is None else value
+                             for value in setting.values()])
+    with open(outputPrefix + ".topics.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["dominance", "topic", "tp", "fp", "fn", "precision", "recall"])
+        for dominance, (metrics, confusion) in topicResults.items():
+            for topic, (tp, fp, fn, precision, recall) in metrics.items():
+                writer.writerow([dominance, topic, tp, fp, fn, formatRatio(precision), formatRatio(recall)])
+    with open(outputPrefix + ".confusion.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["dominance", "expected", "predicted", "files"])
+        for dominance, (metrics, confusion) in topicResults.items():
+            for (expected, predicted), count in sorted(confusion.items()):
+                writer.writerow([dominance, expected, predicted, count])
+    with open(outputPrefix + ".references.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["threshold", "concept", "references", "tp", "fp", "fn", "precision", "recall"])
+        for threshold, metrics in refResults.items():
+            for (name, refs), (tp, fp, fn, precision, recall) in zip(referenceGroups, metrics):
+                writer.writerow([threshold, name, refs.strip(), tp, fp, fn, formatRatio(precision), formatRatio(recall)])
+    return settings
+
+def printSummary(settings, topicFiles, refFiles):
+    print("%d files with a topic label, %d with reference labels, %d settings" % (topicFiles, refFiles, len(settings)))
+    current = [s for s in settings if s["threshold"] == findTags2.thresholdMatches and s["dominance"] == "1/3"]
+    best = [("current", current[0] if current else None),
+            ("best topic accuracy", max(settings, key=lambda s: s["topic accuracy"] or 0)),
+            ("best reference f1", max(settings, key=lambda s: s["reference f1"] or 0))]
+    for title, setting in best:
+        if setting:
+            print("%-20s threshold %3d dominance %-5s  topic accuracy %s  reference precision %s recall %s f1 %s" % (
+                title, setting["threshold"], setting["dominance"],
+                *(formatRatio(setting[name]) or "-" for name in
+                  ("topic accuracy", "reference precision", "reference recall", "reference f1"))))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the topic decision and patent law references of "
+                                                 "findTags2.py on labelled files, for many settings at once")
+    parser.add_argument("labels", help="CSV file with the columns file, topic and/or patentLawRef")
+    parser.add_argument("--hits", action="append", metavar="FILE",
+                        help="take the rule counts from a hits file written by findTags2.py --save-hits, matching the "
+                             "labelled files by name; can be repeated (default: classify the labelled files)")
+    parser.add_argument("--root", metavar="DIR",
+                        help="folder the labelled file paths are relative to (default: the folder of the labels file)")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="number of worker processes used to classify the files (default: 1)")
+    findTags2.addClassificationOptions(parser)
+    parser.add_argument("--thresholds", default="0-10", type=parseThresholds, metavar="LIST",
+                        help="values of thresholdMatches, comma separated numbers and ranges (default: 0-10)")
+    parser.add_argument("--dominance", default="1/2,2/5,1/3,1/4,1/5",
+                        type=lambda text: [Fraction(value) for value in text.split(",")], metavar="LIST",
+                        help="share of the maximum above which another concept makes the topic generic, "
+                             "comma separated (default: 1/2,2/5,1/3,1/4,1/5)")
+    parser.add_argument("--output", default="outputs/evaluation", metavar="PREFIX",
+                        help="writes PREFIX.settings.csv, PREFIX.topics.csv, PREFIX.confusion.csv and "
+                             "PREFIX.references.csv (default: outputs/evaluation)")
+    parser.set_defaults(incremental=False, profile=False, save_hits=True)
+    args = parser.parse_args()
+
+    rows = loadLabels(args.labels)
+    start = time.perf_counter()
+    if args.hits:
+        fileHits = countsFromHits(args.hits, [name for name, topic, refs in rows])
+        missing = [name for (name, topic, refs), found in zip(rows, fileHits) if found is None]
+        if missing:
+            print("%d labelled files are not in the hits files or have no text, e.g. %s" % (len(missing), missing[0]))
+    else:
+        root = args.root or os.path.dirname(args.labels)
+        fileHits = countsFromFiles([os.path.join(root, name) for name, topic, refs in rows], args)
+    print("rule counts of %d files in %.1fs" % (len(rows), time.perf_counter() - start))
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    settings = evaluate(rows, fileHits, args.thresholds, args.dominance, args.output)
+    printSummary(settings, sum(1 for row in rows if row[1]), sum(1 for row in rows if row[2] is not None))
+    print("%d settings evaluated in %.2fs, written to %s.*.csv" % (len(settings), time.perf_counter() - start, args.output))
@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+
+
+def fileHash(path, data=None):
+    # sha256 of the file content, read in blocks so big PDFs are not loaded at once, or of data when it was read already
+    if data is not None:
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    # on-disk cache of what getPowerPointText/getWordText/getPDFText return,
+    # keyed by file content hash + extractor version, evicting the least recently used entries
+    # each process opens its own connection, so the cache can be shared by the --jobs workers
+
+    def __init__(self, cacheDir, maxBytes):
+        os.makedirs(cacheDir, exist_ok=True)
+        self.maxBytes = maxBytes
+        self.db = sqlite3.connect(os.path.join(cacheDir, "extraction.sqlite"), timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.db.commit()
+
+    def get(self, key):
+        # returns (value, bytes read) or (None, 0) when the key is not cached
+        found = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if found is None:
+            return None, 0
+        with self.db:
+            self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(zlib.decompress(found[0])), len(found[0])
+
+    def put(self, key, value):
+        # stores value (anything json can hold) and returns the bytes written
+        blob = zlib.compress(json.dumps(value).encode("utf-8"), 1)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+        self.evict()
+        return len(blob)
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        excess = self.size() - self.maxBytes
+        if excess <= 0:
+            return
+        with self.db:
+            for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                excess -= size
+                if excess <= 0:
+                    break
@@ -1,315 +1,199 @@
-import sys
 import os
+import csv
+import argparse
+import json
+import collections
+import concurrent.futures
+import io
+import hashlib
 import re
+import time
 import string
+import threading
 from enum import Enum
-import unicodedata, itertools
 
-import pptx
-from docx import Document
-import pdfplumber
-import xlsxwriter
-from polyglot.detect import Detector
+# pdfplumber, pdfminer, openpyxl, xlsxwriter (in rowSinks) and polyglot (in languageDetection) are imported by the functions that use them,
+# so a run only loads the libraries of the file types it meets
 
+from extractionCache import ExtractionCache, fileHash
+import topicRules
+import ooxmlText
+import profiling
+import languageDetection
+import rowSinks
+import isolatedPool
 
-def getPowerPointText(path):
+
+def fileSource(path, data):
+    # what the parsers open: the file, or its content when it was read ahead by the prefetch threads
+    return path if data is None else io.BytesIO(data)
+
+def getPowerPointText(path, data=None):
     # list of slides as text
     slides = []
     title = ""
     year = ""
     try:
-        prs = pptx.Presentation(path)
-    except:
+        slideCount, slideShapes = ooxmlText.iterSlideShapeTexts(fileSource(path, data))
+        for shapeTexts in slideShapes:
+            slides.append(" ".join(control_char_re.sub(' ', text) for text in shapeTexts))
+            if len(slides) == 1:
+                title, year = firstSlideTitleYear(shapeTexts)
+    except Exception:
         print("--------- Error with: ", path)
-        return slides, title, year
-    for slide in prs.slides:
-        slideContent = []
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                slideContent.append(control_char_re.sub(' ', shape.text))
-        slides.append(" ".join(slideContent))
-    for shape in prs.slides[0].shapes:
-        if hasattr(shape, "text"):
-            if len(shape.text) > 0:
-                try:
-                    foundText = re.match('^([^\r\n]+)', shape.text).group(1)
-                except AttributeError:
-                    continue
-                if foundText != "The European Patent Office":
-                    title = control_char_re.sub(' ', foundText)
-                    title = (title[:250] + "..") if len(title) > 250 else title
-                    break
+        return [], "", "", ""
+    return slides, title, year, slideCount + 1
+
+def firstSlideTitleYear(shapeTexts):
+    # title: first line of the first shape with text, unless it is the EPO banner; year: first year found in a shape
+    title = ""
+    year = ""
     yearRegex = re.compile('(201[4-9]|202[0-2])', re.IGNORECASE)
-    for shape in prs.slides[0].shapes:
-        if hasattr(shape, "text"):
-            year = yearRegex.search(shape.text)
-            if year:
-                year = year.group(1)
-                break
-    return slides, title, year, len(prs.slides) + 1
+    for text in shapeTexts:
+        if not title and len(text) > 0:
+            foundText = re.match('^([^\r\n]+)', text)
+            if foundText and foundText.group(1) != "The European Patent Office":
+                title = control_char_re.sub(' ', foundText.group(1))
+                title = (title[:250] + "..") if len(title) > 250 else title
+        if not year:
+            year = yearRegex.search(text)
+            if year: year = year.group(1)
+    return title, year
 
-def getWordText(path):
+def getWordText(path, data=None):
     # list of paragraphs
     paragraphs = []
     title = ""
     year = ""
     try:
-        doc = Document(path)
-    except:
+        paragraphs = ooxmlText.documentParagraphs(fileSource(path, data))
+    except Exception:
         print("--------- Error with: ", path)
-        return paragraphs, title, year
-    for para in doc.paragraphs:
-        paragraphs.append(para.text)
-    title = control_char_re.sub(' ', doc.paragraphs[0].text)
+        return [], title, year
+    if paragraphs: title = control_char_re.sub(' ', paragraphs[0])
     yearRegex = re.compile('(201[4-9]|202[0-2])', re.IGNORECASE)
-    for parNum in range(min(20, len(doc.paragraphs) - 1)):
-        year = yearRegex.search(doc.paragraphs[parNum].text)
+    for parNum in range(min(20, len(paragraphs) - 1)):
+        year = yearRegex.search(paragraphs[parNum])
         if year:
             year = year.group(1)
             break
     return paragraphs, title, year
 
-def getPDFText(path):
-    pdf = pdfplumber.open(path)
-    pages = []
-    for singlePage in pdf.pages:
-        pages.append(singlePage.extract_text())
+def iterPDFPages(pdf):
+    # text of each page, extracted only when the caller asks for it; the characters and objects pdfplumber
+    # caches for a page are released once its text is taken, and the document is closed with the generator
+    with pdf:
+        for singlePage in pdf.pages:
+            yield singlePage.extract_text()
+            singlePage.close()
+
+def openPlumberPDF(path, data=None):
+    # returns the page count and a generator of the page texts
+    import pdfplumber
+    pdf = pdfplumber.open(fileSource(path, data))
+    return len(pdf.pages), iterPDFPages(pdf)
+
+def iterMinerPages(pdfFile, document):
+    # plain pdfminer text conversion, without the character and layout objects pdfplumber builds for each page
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    resources = PDFResourceManager(caching=True)
+    output = io.StringIO()
+    interpreter = PDFPageInterpreter(resources, TextConverter(resources, output, laparams=LAParams()))
+    with pdfFile:
+        for singlePage in PDFPage.create_pages(document):
+            interpreter.process_page(singlePage)
+            yield output.getvalue().rstrip("\n\x0c")
+            output.seek(0)
+            output.truncate()
+
+def openMinerPDF(path, data=None):
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfpage import PDFPage
+    pdfFile = open(path, "rb") if data is None else io.BytesIO(data)
+    document = PDFDocument(PDFParser(pdfFile))
+    return sum(1 for _ in PDFPage.create_pages(document)), iterMinerPages(pdfFile, document)
+
+pdfBackends = {"fast": openMinerPDF, "pdfplumber": openPlumberPDF}
+# rows of a sheet in one text unit of getExcelText
+sheetBlockRows = 50
+
+def iterSheetBlocks(workbook):
+    # the cells with text of each block of sheetBlockRows rows of every sheet
+    for sheet in workbook.worksheets:
+        block = []
+        rows = 0
+        for values in sheet.iter_rows(values_only=True):
+            block.extend(control_char_re.sub(' ', str(value)) for value in values if value is not None and str(value).strip())
+            rows += 1
+            if rows == sheetBlockRows:
+                if block: yield block
+                block = []
+                rows = 0
+        if block: yield block
+
+def getExcelText(path, enoughText=None, data=None):
+    # list of sheet row blocks as text, the cells joined by spaces
+    # the workbook is read in read-only mode, which keeps only the shared strings and the current row in memory,
+    # and enoughText stops the reading when the following rows are not needed, like for the PDF pages
+    from openpyxl import load_workbook
+    blocks = []
+    title = ""
     year = ""
-    year = re.search('(201[4-9]|202[0-2])', pdf.pages[0].extract_text())
+    try:
+        workbook = load_workbook(fileSource(path, data), read_only=True, data_only=True)
+        try:
+            for cells in iterSheetBlocks(workbook):
+                # title: the first cell with text
+                if not blocks:
+                    title = (cells[0][:250] + "..") if len(cells[0]) > 250 else cells[0]
+                blocks.append(" ".join(cells))
+                if enoughText and enoughText(blocks[-1]):
+                    break
+        finally:
+            workbook.close()
+    except Exception:
+        print("--------- Error with: ", path)
+        return [], "", ""
+    yearRegex = re.compile('(201[4-9]|202[0-2])', re.IGNORECASE)
+    for block in blocks[:20]:
+        year = yearRegex.search(block)
+        if year:
+            year = year.group(1)
+            break
+    return blocks, title, year or ""
+
+def getPDFText(path, makeBudget=None, backend="fast", throughput=None, data=None):
+    # makeBudget returns the callback of one extraction, like TextBudget: it is called with each page text and
+    # returns True when the following pages are not needed
+    # pdfplumber is used again when the selected backend finds no text at all
+    # throughput collects the pages extracted and the seconds spent by each backend
+    for name in dict.fromkeys([backend, "pdfplumber"]):
+        enoughText = makeBudget() if makeBudget else None
+        start = time.perf_counter()
+        pageCount, pageTexts = pdfBackends[name](path, data)
+        pages = []
+        try:
+            for pageText in pageTexts:
+                pages.append(pageText)
+                if enoughText and enoughText(pageText):
+                    break
+        finally:
+            # closes the document now, also when the last pages are not needed
+            pageTexts.close()
+        if throughput is not None:
+            throughput.setdefault(name, [0, 0.0])
+            throughput[name][0] += len(pages)
+            throughput[name][1] += time.perf_counter() - start
+        if any(pages):
+            break
+    year = ""
+    year = re.search('(201[4-9]|202[0-2])', pages[0])
     if year: year = year.group(1)
-    return pages, year, len(pdf.pages) + 1
-
-def get_TypeOfMaterial(filetype, onlyText):
-    query1 = re.compile('exercises?', re.IGNORECASE)
-    query2 = re.compile('exercise.{,5}solution', re.IGNORECASE)
-    query3 = re.compile('case stud', re.IGNORECASE)
-    query4 = re.compile('cheat sheet', re.IGNORECASE)
-    query5 = re.compile('mock', re.IGNORECASE)
-    result = []
-    if filetype == extension.PPTX: result.append("Presentation|2dc089fb-8444-4cd3-a9ca-9fcc728aac7a; ")
-    if any(query1.search(line) for line in onlyText): result.append("Exercise|cac0e695-c696-42d9-acac-27fc80b91501; ")
-    if any(query2.search(line) for line in onlyText): result.append("Exercise - solutions|68e2a42d-6972-42be-bc70-6af1335b444c; ")
-    if any(query3.search(line) for line in onlyText): result.append("Case study|4e679404-4a79-4ace-9bdb-d5f72cd66b0d; ")
-    if any(query4.search(line) for line in onlyText): result.append("Cheat sheet|833de978-768a-4a78-a2fa-1f4bebe0d6a7; ")
-    if any(query5.search(line) for line in onlyText): result.append("Mock|eba4b3c5-2cd7-41bc-b7fd-487d6d5586d5; ")
-    return ''.join(result)
-
-def get_ip_strategy(onlyText):
-    query = re.compile('(?:ip|intellectual property).{1,4}strat?g??', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_patent_licencing(onlyText):
-    query = re.compile('li[cs]en[csz]', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_patent_landscape(onlyText):
-    query = re.compile('landscap', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_patent_valuation(onlyText):
-    query = re.compile('(?:valuation|bewert|valoris)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_boa_decisions(onlyText):
-    query = re.compile('[gtj][, ][0-9][0-9][0-9][0-9]/[0-9][0-9]', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_classification(onlyText):
-    query = re.compile('classif', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_amendments(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}(?:123|76)|(?:richtlinie|guideline|directive|GL) ?H)', re.IGNORECASE)
-    query2 = re.compile('amendment', re.IGNORECASE)
-    query3 = re.compile('(?:A|Art).{0,10}(?:19\(2\)|34\(2.?b\)).?PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_clarity(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}84|F-IV.{0,3}4|(?:richtlinie|guideline|directive|GL) ?F[- ]?IV.{0,3}4)', re.IGNORECASE)
-    query2 = re.compile('(?:clarity|suff.+ (of)? disclos|broad claim|lack of support|concise)', re.IGNORECASE)
-    query3 = re.compile('(?:A|Art).{0,10}6.?PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_exclusions(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}53|(?:r|rule|regle|regel).{0,10}(?:28|29)|(?:richtlinie|guideline|directive|GL) ?G[- ]?II.{0,3}[345])', re.IGNORECASE)
-    query2 = re.compile('(?:(?:exception|exclusion).{1,5}patentability|ordre public|treatments?(?:\s\S){0,4} bod|(?:surgery|therapy|diagnostic)(?:\s\S){0,4} (?:human|animal)|human embryo|clon.{1,3}(?:\s\S){0,2} human|human(?:\s\S){0,4} clon.{1,3})', re.IGNORECASE)
-    query3 = re.compile('(?:A|Art).(?:9\.1|39\.1|67\.1).{0,8}PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_inventiveness(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}56|(?:richtlinie|guideline|directive|GL) ?G[- ]?VII[^IV])', re.IGNORECASE)
-    query2 = re.compile('(?:inventive step|inventiveness|erfinderische Tätigkeit|activité inventive)', re.IGNORECASE)
-    query3 = re.compile('(?:A|Art).{0,10}33.3.{0,8}PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_novelty(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}54|F-IV|(?:richtlinie|guideline|directive|GL) ?F[- ]?IV)', re.IGNORECASE)
-    query2 = re.compile('(?:novelty|nouveauté|neuheit)', re.IGNORECASE)
-    query3 = re.compile('(?:R|Rule).{0,10}33\.1.?[abc].{0,10}PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_priority(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}(?:87|88|89)|F-VI[^IV]|(?:richtlinie|guideline|directive|GL) ?F[- ]?VI[^IV])', re.IGNORECASE)
-    query2 = re.compile('(?:priority|priorität|priorité|state of the art|stand der technik|art antérieur)', re.IGNORECASE)
-    query3 = re.compile('(?:(?:A|Art).{0,10}8 ?PCT|(?:R|Rule).{0,10}64\.1.?PCT)', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_sufficiency(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}83|(?:richtlinie|guideline|directive|GL) ?F[- ]?III)', re.IGNORECASE)
-    query2 = re.compile('(?:F-III|sufficien.{1,3}(?:\s\S){0,3} disclos|offenbarung)', re.IGNORECASE)
-    query3 = re.compile('(?:A|Art).{0,10}5 ?PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_unity(onlyText):
-    query1 = re.compile('(?:(?:A|Art).{0,10}82|(?:richtlinie|guideline|directive|GL) ?F[- ]?V[^IV]|F-V[^IV])', re.IGNORECASE)
-    query2 = re.compile('(?:G ?2/92|unity of invention|require.{1,5}(?:\s\S){0,2} unity|einheitlichkeit|unité)', re.IGNORECASE)
-    query3 = re.compile('(?:A|Art).{0,10}13\.1 ?PCT', re.IGNORECASE)
-    epc = 0
-    pct = 0
-    common = 0
-    for i, item in enumerate(onlyText):
-        if query1.search(item):
-            epc += 1
-            common += 1
-        if query2.search(item): common += 1
-        if query3.search(item):
-            pct += 1
-            common += 1
-    return [common, epc, pct]
-
-def get_pct(onlyText):
-    query = re.compile('(?:chapter I|chapter II|PCT procedure)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_national(onlyText):
-    query = re.compile('(?:national|NATL|USPTO|CIPO|SIPO|KIPO|JPO|INPI|DPMA)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_litigation(onlyText):
-    query = re.compile('(?:litig+|infring|contre.?fa)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_enforcement(onlyText):
-    query = re.compile('enforcement?', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_revocation(onlyText):
-    query = re.compile('r.?vo.?at', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_eqe(onlyText):
-    query = re.compile('(?:eqe|apec)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_diversity(onlyText):
-    query = re.compile('(?:D&I|diversity(?:-| | and )?incl)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_data_protection(onlyText):
-    query = re.compile('(?:DPO|GDPR|data protection)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def get_wellbeing(onlyText):
-    query = re.compile('(?:well.?be|mental.?health)', re.IGNORECASE)
-    matchesIndex = [i for i, item in enumerate(onlyText) if query.search(item)]
-    return len(matchesIndex)
-
-def writeFields(fields, worksheetOut):
-    column = 0
-    for field in fields:
-        worksheetOut.write(row, column, field)
-        column += 1
+    return pages, year, pageCount + 1
 
 
 
@@ -338,24 +222,17 @@ topics = [
     "Data Protection|6266e964-0e74-46b3-bd74-0c54995ca7de",
     "Mental Well-being|b41b1481-41ff-4613-a353-ad9e38d06f6e"
     ]
+# topic of the documents about several patent law concepts
+genericTopic = "Patent law concepts|493f6ca1-16fd-4f96-bcd7-e46f81984678"
 
 class extension(Enum):
     PPTX = 1
     DOCX = 2
     PDF  = 3
+    XLSX = 4
 
 thresholdMatches = 3
 
-onlyFiles = sorted([f for f in os.listdir(sys.argv[1]) if os.path.isfile(os.path.join(sys.argv[1], f))], key=str.lower)
-outputFile = re.sub('^[./]+', '', sys.argv[1])
-outputFile = re.sub('^files/', '', outputFile)
-outputFile = re.sub('/$', '', outputFile)
-outputFile = re.sub('/', '-', outputFile)
-
-workbook = xlsxwriter.Workbook('outputs/' + outputFile + '.xlsx')
-worksheet = workbook.add_worksheet()
-row = 0
-column = 0
 content = [
     "File name", "Pages", "Title", "Type of material",
     "Language", "Year", "Topic",
@@ -367,189 +244,807 @@ content = [
     "national", "litigation", "enforcement",
     "revocation", "eqe", "diversity",
     "data_protection", "wellbeing"]
-for item in content :
-    worksheet.write(row, column, item)
-    column += 1
-row += 1
+
+# attribute names of the columns in Classification
+rowNames = ["fileName", "pages", "title", "typeOfMaterial", "language", "year", "topic", "patentLawRef"] + topicRules.columns
+
+# columns written as numbers by the typed outputs
+numericContent = {content[1]} | set(content[8:31])
 
 rPPTX = re.compile(".*\.pptx$", re.IGNORECASE)
 rDOCX = re.compile(".*\.docx$", re.IGNORECASE)
 rPDF = re.compile(".*\.pdf$", re.IGNORECASE)
+rXLSX = re.compile(".*\.xlsx$", re.IGNORECASE)
+
+# C0 and C1 control characters
+control_char_re = re.compile('[\x00-\x1f\x7f-\x9f]')
+
+class TextBudget:
+    # tells getPDFText and getExcelText when the rest of the document cannot change the row anymore: past topicChars characters
+    # the topics are not counted, and at least languageUnits units are there for the language sample,
+    # so only the type of material still needs the text until all its rules have matched
+    def __init__(self):
+        self.units = 0
+        self.characters = 0
+        self.pendingMaterial = list(topicRules.materialIndexes)
+
+    def __call__(self, text):
+        if text:
+            self.units += 1
+            self.characters += len(text)
+            folded = topicRules.fold(text)
+            self.pendingMaterial = [i for i in self.pendingMaterial if not topicRules.ruleMatches(i, text, folded)]
+        return (self.units >= languageDetection.languageUnits and self.characters >= topicChars
+                and not self.pendingMaterial)
+
+# bump when the output of the get*Text functions changes, so the cached extractions are not used anymore
+extractorVersion = 5
+extractionCache = None
+
+hashFiles = False
+# processFile returns the hit matrix and title concepts of each file in info["hits"] (--save-hits)
+keepHits = False
+pdfBackend = "fast"
+profileFiles = False
+# budgets of the topic counting of one file: characters, and seconds (None for no time limit)
+topicChars = 10000000
+topicSeconds = None
+
+def initWorker(options):
+    # runs once in every process that calls processFile
+    global extractionCache, hashFiles, keepHits, pdfBackend, profileFiles, topicChars, topicSeconds
+    pdfBackend = options.pdf_backend
+    profileFiles = options.profile
+    topicChars = options.topic_chars
+    topicSeconds = options.topic_seconds
+    if options.cache_dir:
+        extractionCache = ExtractionCache(options.cache_dir, options.cache_size * 1000000)
+    hashFiles = options.incremental
+    keepHits = options.save_hits
+
+def extractText(fullPath, filetype, info, data=None):
+    # returns the text units, title, year and page count of a file, from the extraction cache when possible
+    if extractionCache:
+        key = "%s:%s:%d" % (info["hash"], filetype.name, extractorVersion)
+        if filetype == extension.PDF: key += ":%s:%d" % (pdfBackend, topicChars)
+        if filetype == extension.XLSX: key += ":%d" % topicChars
+        cached, info["cacheBytes"] = extractionCache.get(key)
+        if cached is not None:
+            info["cache"] = "hit"
+            return cached
+    title = ""
+    pages = ""
+    if filetype == extension.PPTX:
+        onlyText, title, year, pages = getPowerPointText(fullPath, data)
+    if filetype == extension.DOCX:
+        onlyText, title, year = getWordText(fullPath, data)
+    if filetype == extension.PDF:
+        onlyText, year, pages = getPDFText(fullPath, TextBudget, pdfBackend, info.setdefault("pdfThroughput", {}), data)
+    if filetype == extension.XLSX:
+        onlyText, title, year = getExcelText(fullPath, TextBudget(), data)
+    extracted = [onlyText, title, year, pages]
+    if extractionCache:
+        info["cache"] = "miss"
+        info["cacheBytes"] = extractionCache.put(key, extracted)
+    return extracted
+
+class Classification:
+    # one output row: the 31 columns of content as attributes, and whether any text was found in the file
+    __slots__ = rowNames + ["useful"]
+
+    def __init__(self, fields, useful):
+        for name, value in zip(rowNames, fields):
+            setattr(self, name, value)
+        self.useful = useful
+
+    def fields(self):
+        # the values in the order of content
+        return [getattr(self, name) for name in rowNames]
 
-all_chars = (chr(i) for i in range(sys.maxunicode))
-categories = {'Cc'}
-control_chars = ''.join(map(chr, itertools.chain(range(0x00,0x20), range(0x7f,0xa0))))
-control_char_re = re.compile('[%s]' % re.escape(control_chars))
+    def __repr__(self):
+        return "Classification(%r, %r)" % (self.fields(), self.useful)
 
-usefulFiles = 0
-for eachFile in onlyFiles:
-#    print(eachFile)
+def fileType(name):
+    # the extension of the files that are classified, "" for the other files
+    if rPPTX.match(name): return extension.PPTX
+    if rDOCX.match(name): return extension.DOCX
+    if rPDF.match(name): return extension.PDF
+    if rXLSX.match(name): return extension.XLSX
+    return ""
+
+def extract(path, info=None, data=None, contentHash=None):
+    # returns the text units, title, year and page count of a file, empty when it is not a classified type
+    # info collects details about the processing; contentHash is the fileHash of the file when it is known already
+    info = {} if info is None else info
+    filetype = fileType(path)
+    if not filetype:
+        return [], "", "", ""
+    if extractionCache or hashFiles: info["hash"] = contentHash or fileHash(path, data)
+    return extractText(path, filetype, info, data)
+
+def classify(units, title, filetype, info=None, clock=profiling.noClock):
+    # classifies the text units of a document; file name, pages and year are left empty in the result
+    # info collects details about the processing and clock times the stages
+    info = {} if info is None else info
     fields = [""] * 31
-    fullPath = os.path.join(sys.argv[1], eachFile)
-    fields[0] = eachFile
+    fields[2] = title
 
-    onlyText = []
-    filetype = ""
-    if rPPTX.match(eachFile):
-        onlyText, fields[2], fields[5], fields[1] = getPowerPointText(fullPath)
-        filetype = extension.PPTX
-    if rDOCX.match(eachFile):
-        onlyText, fields[2], fields[5] = getWordText(fullPath)
-        filetype = extension.DOCX
-    if rPDF.match(eachFile):
-        onlyText, fields[5], fields[1] = getPDFText(fullPath)
-        filetype = extension.PDF
-
-    if onlyText: onlyText = list(filter(None, onlyText))
+    onlyText = list(filter(None, units)) if units else []
+    clock("filter")
+    if "profile" in info: info["profile"]["units"] = len(onlyText)
     if not len(onlyText):
-        writeFields(fields, worksheet)
-        row += 1
-        continue
-    usefulFiles += 1
-
-    fields[3] = get_TypeOfMaterial(filetype, onlyText)
-    fields[4] = Detector(''.join(x for x in "".join(onlyText[0:min(50,len(onlyText))]) if x.isprintable()), quiet=True).language.code.upper()
-
-    if len(onlyText) > 150:
-        writeFields(fields, worksheet)
-        row += 1
-        continue
-
-    fields[8] = get_ip_strategy(onlyText)
-    fields[9] = get_patent_licencing(onlyText)
-    fields[10] = get_patent_landscape(onlyText)
-    fields[11] = get_patent_valuation(onlyText)
-    fields[12] = get_boa_decisions(onlyText)
-    fields[13] = get_classification(onlyText)
-
-    epcMatches = 0
-    pctMatches = 0
-
-    amendments = get_amendments(onlyText)
-    fields[14] = amendments[0]
-    epcMatches += amendments[1]
-    pctMatches += amendments[2]
-    if amendments[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 123 EPC; Art. 76 EPC; "
-    if amendments[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 19(2) PCT, Art. 34(2)(b) PCT; "
-
-    clarity = get_clarity(onlyText)
-    fields[15] = clarity[0]
-    epcMatches += clarity[1]
-    pctMatches += clarity[2]
-    if clarity[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 84 EPC; "
-    if clarity[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 6 PCT; "
-
-    exclusions = get_exclusions(onlyText)
-    fields[16] = exclusions[0]
-    epcMatches += exclusions[1]
-    pctMatches += exclusions[2]
-    if exclusions[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 53 EPC; Rule 28 EPC; Rule 29 EPC; "
-    if exclusions[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 9.1 PCT; Rule 39.1 PCT; Rule 67.1 PCT; "
-
-    inventiveness = get_inventiveness(onlyText)
-    fields[17] = inventiveness[0]
-    epcMatches += inventiveness[1]
-    pctMatches += inventiveness[2]
-    if inventiveness[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 56 EPC; "
-    if inventiveness[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 33(3) PCT; "
-
-    novelty = get_novelty(onlyText)
-    fields[18] = novelty[0]
-    epcMatches += novelty[1]
-    pctMatches += novelty[2]
-    if novelty[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 54 EPC; "
-    if novelty[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 33.1 PCT; "
-
-    priority = get_priority(onlyText)
-    fields[19] = priority[0]
-    epcMatches += priority[1]
-    pctMatches += priority[2]
-    if priority[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 87 EPC; Art. 88 EPC; Art. 89 EPC; "
-    if priority[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 8 PCT; Rule 64.1 PCT; "
-
-    sufficiency = get_sufficiency(onlyText)
-    fields[20] = sufficiency[0]
-    epcMatches += sufficiency[1]
-    pctMatches += sufficiency[2]
-    if sufficiency[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 83 EPC; "
-    if sufficiency[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 5 PCT; "
-
-    unity = get_unity(onlyText)
-    fields[21] = unity[0]
-    epcMatches += unity[1]
-    pctMatches += unity[2]
-    if unity[1] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 82 EPC; "
-    if unity[2] > thresholdMatches:
-        fields[7] = fields[7] + "Art. 13.1 PCT; "
-
-    pct = get_pct(onlyText)
-    pctMatches += pct
-    fields[22] = pctMatches
-
-    fields[23] = get_national(onlyText)
-    fields[24] = get_litigation(onlyText)
-    fields[25] = get_enforcement(onlyText)
-    fields[26] = get_revocation(onlyText)
-    fields[27] = get_eqe(onlyText)
-    fields[28] = get_diversity(onlyText)
-    fields[29] = get_data_protection(onlyText)
-    fields[30] = get_wellbeing(onlyText)
-
-    maxMatches = max(fields[8:30])
+        return Classification(fields, False)
+
+    # a single pass over the text counts every rule, the topic rules within the budgets
+    deadline = time.perf_counter() + topicSeconds if topicSeconds is not None else None
+    materialHits, hits = topicRules.countMatches(onlyText, topicChars, deadline)
+    if len(hits) < len(onlyText): info["topicUnits"] = len(hits)
+    clock("topics")
+    fields[3] = topicRules.typeOfMaterial(filetype == extension.PPTX, materialHits)
+    clock("material")
+    fields[4] = languageDetection.detectLanguage(onlyText)
+    clock("language")
+
+    # the counts are the column sums of the hit matrix, which is kept with --save-hits to decide the topics again
+    fields[8:31], fields[7] = topicRules.topicColumns(hits.sum(axis=0), thresholdMatches)
+    clock("topics")
+    titleMatches = topicRules.titleConcepts(fields[2])
+    if keepHits: info["hits"] = hits, titleMatches
+    fields[6] = decideTopic(fields[8:31], titleMatches)
+    clock("title")
+
+    return Classification(fields, True)
+
+def decideTopic(values, titleMatches, dominance=3):
+    # the topic of a document from its topic columns (fields[8:31]) and whether the title matches each patent law concept
+    # another concept above 1/dominance of the maximum makes the topic generic when the title does not decide
+    maxMatches = max(values[0:22])
 #    print(maxMatches)
-    maxMatchesIndexes = [i for i, j in enumerate(fields[8:30]) if j == maxMatches]
+    maxMatchesIndexes = [i for i, j in enumerate(values[0:22]) if j == maxMatches]
     if len(maxMatchesIndexes) > 1:
-        fields[6] = " "
+        return " "
+    # assigns the topic to the concept with most matches
+    topic = topics[maxMatchesIndexes[0]]
+    # if the topic is in the patent law concepts check the title
+    if maxMatchesIndexes[0] > 5 and maxMatchesIndexes[0] < 14:
+        # check if there is only one matching concept in the title
+        nonNullMatches = [i for i, j in enumerate(titleMatches) if j]
+#        print(nonNullMatches)
+        # if only one found, assign the topic to that one
+        if len(nonNullMatches) == 1:
+            topic = topics[6 + nonNullMatches[0]]
+        # if there are multiple matching concepts, check if the fulltext matches one more than 3x the other ones
+        # we know already from the checks at the beginning that only one field has the max value
+        if len(nonNullMatches) > 1 or len(nonNullMatches) == 0:
+            for i, j in enumerate(values[6:13]):
+        # if any value is higher than 1/3 the max, assign generic topic
+                if j > maxMatches/dominance and i != (maxMatchesIndexes[0] - 6):
+                    topic = genericTopic
+    return topic
+
+def processFile(directory, eachFile, data=None, contentHash=None):
+    # returns the row for one file, whether any text was found in it and a dict with details about the processing
+    # runs in the worker processes when --jobs is greater than 1
+    fullPath = os.path.join(directory, eachFile)
+    info = {}
+    # with --profile the seconds of each stage are returned in info["profile"]
+    clock = profiling.StageClock() if profileFiles else profiling.noClock
+    if profileFiles: info["profile"] = {"size": os.path.getsize(fullPath) if data is None else len(data), "units": 0, "pages": "", "stages": clock.stages}
+
+    filetype = fileType(eachFile)
+    units, title, year, pages = [], "", "", ""
+    if filetype:
+        units, title, year, pages = extract(fullPath, info, data, contentHash)
+        clock("open")
+        if profileFiles and pages != "": info["profile"]["pages"] = pages - 1
+
+    result = classify(units, title, filetype, info, clock)
+    result.fileName, result.pages, result.year = eachFile, pages, year
+    return result.fields(), result.useful, info
+
+def classifyFile(path):
+    # classifies one file with the settings of initWorker, or the defaults when it was not called
+    fields, useful, info = processFile(os.path.dirname(path), os.path.basename(path))
+    return Classification(fields, useful)
+
+def measuredProcessFile(directory, eachFile, data=None, contentHash=None):
+    # processFile, adding to info the peak resident memory of the process while it ran
+    profiling.resetPeakRSS()
+    fields, useful, info = processFile(directory, eachFile, data, contentHash)
+    info["peakRSS"] = profiling.peakRSS()
+    return fields, useful, info
+
+def manifestSettings(options):
+    # the settings the rows depend on; the rows of a manifest saved with other settings are not reused
+    # saveHits too: the files reused from a run without --save-hits have no hit matrix to carry over
+    return {"extractorVersion": extractorVersion, "pdfBackend": options.pdf_backend,
+            "topicChars": options.topic_chars, "topicSeconds": options.topic_seconds, "saveHits": options.save_hits}
+
+def loadManifest(manifestPath, settings):
+    # the manifest maps each file name to its size, mtime, content hash and the row written for it
+    try:
+        with open(manifestPath, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if any(manifest.get(name) != value for name, value in settings.items()):
+        return {}
+    return manifest["files"]
+
+def saveManifest(manifestPath, files, settings):
+    with open(manifestPath + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(dict(settings, files=files), f)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+def saveShard(shardPath, shard, listed, rows):
+    # the rows of one --shard run of a folder as [position among the listed files of the folder, fields, useful],
+    # combined with those of the other shards by mergeShards.py
+    with open(shardPath + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"shard": shard, "listed": listed, "rows": rows}, f)
+    os.replace(shardPath + ".tmp", shardPath)
+
+def unchangedEntry(previous, fileStat):
+    # the previous row is reused when size and mtime are the same; when only the mtime changed, the pipeline
+    # reads the file and reuses the row if the content is the same (see StoredRow)
+    return previous is not None and previous["size"] == fileStat.st_size and previous["mtime"] == fileStat.st_mtime_ns
+
+def saveHits(hitsPath, fileHits):
+    # fileHits maps file names to their hit matrix and title concepts; the matrices are stacked in one array,
+    # the rows of the i-th file going from offsets[i] to offsets[i + 1]
+    import numpy
+    names = list(fileHits)
+    with open(hitsPath + ".tmp", "wb") as f:
+        numpy.savez_compressed(
+            f, files=numpy.array(names, dtype=str), rules=numpy.array(topicRules.topicNames),
+            patterns=numpy.array([topicRules.queries[i].pattern for i in topicRules.topicIndexes]),
+            offsets=numpy.cumsum([0] + [len(fileHits[name][0]) for name in names]),
+            hits=numpy.concatenate([numpy.zeros((0, len(topicRules.topicIndexes)), dtype=bool)] +
+                                   [fileHits[name][0] for name in names]),
+            titleHits=numpy.array([fileHits[name][1] for name in names], dtype=bool).reshape(len(names), len(topicRules.conceptRules)))
+    os.replace(hitsPath + ".tmp", hitsPath)
+
+def loadHits(hitsPath):
+    # the matrices saved by saveHits by file name, empty when there are none or the topic queries changed since
+    import numpy
+    try:
+        data = numpy.load(hitsPath)
+    except (OSError, ValueError):
+        return {}
+    with data:
+        if data["patterns"].tolist() != [topicRules.queries[i].pattern for i in topicRules.topicIndexes]:
+            return {}
+        offsets, hits, titleHits = data["offsets"], data["hits"], data["titleHits"]
+        return {name: (hits[offsets[i]:offsets[i + 1]], titleHits[i].tolist()) for i, name in enumerate(data["files"].tolist())}
+
+def topicsFromHits(hitsPath, threshold=thresholdMatches):
+    # decides the topics again from the hit matrices saved with --save-hits, without opening the classified files:
+    # yields the name, topic columns (fields[8:31]), patent law references and topic of each file with text
+    for name, (hits, titleMatches) in loadHits(hitsPath).items():
+        values, patentLawRef = topicRules.topicColumns(hits.sum(axis=0), threshold)
+        yield name, values, patentLawRef, decideTopic(values, titleMatches)
+
+def loadQuarantine(quarantinePath):
+    # the files that failed or ran out of time or memory in earlier runs, by absolute path
+    try:
+        with open(quarantinePath, encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError):
+        return {}
+
+def saveQuarantine(quarantinePath, files):
+    with open(quarantinePath + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, indent=1)
+    os.replace(quarantinePath + ".tmp", quarantinePath)
+
+def quarantined(quarantine, fullPath, fileStat):
+    # a quarantined file is tried again once its size or mtime changes
+    entry = quarantine.get(os.path.abspath(fullPath))
+    return entry is not None and entry["size"] == fileStat.st_size and entry["mtime"] == fileStat.st_mtime_ns
+
+def failedRow(eachFile):
+    fields = [""] * 31
+    fields[0] = eachFile
+    return fields
+
+def listFiles(directory):
+    with os.scandir(directory) as entries:
+        return sorted([entry.name for entry in entries if entry.is_file()], key=str.lower)
+
+def walkDirectories(root):
+    # root and every folder below it, in name order, without following symbolic links
+    yield root
+    with os.scandir(root) as entries:
+        subdirectories = sorted([entry.path for entry in entries if entry.is_dir(follow_symlinks=False)], key=str.lower)
+    for subdirectory in subdirectories:
+        yield from walkDirectories(subdirectory)
+
+def outputName(directory):
+    outputFile = re.sub('^[./]+', '', directory)
+    outputFile = re.sub('^files/', '', outputFile)
+    outputFile = re.sub('/$', '', outputFile)
+    outputFile = re.sub('/', '-', outputFile)
+    return outputFile
+
+def parseShard(text):
+    # "i/N": the i-th of N slices of the files, i from 1 to N
+    index, count = (int(number) for number in text.split("/"))
+    return index, count
+
+def shardSuffix(shard):
+    return ".shard-%d-of-%d" % shard if shard else ""
+
+def inShard(outputFile, eachFile, shard):
+    # the slice of a file depends only on its path relative to the classified folders, so every machine
+    # running the same command line with another --shard takes different files
+    index, count = shard
+    digest = hashlib.sha1((outputFile + "/" + eachFile).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count == index - 1
+
+class StoredRow:
+    # the row of a file from the previous --incremental run, used like a task whose result is ready: as the
+    # first copy of a content with --dedup, or as the row of a file whose mtime changed but not its content
+    def __init__(self, contentHash, fields, useful, hits):
+        self.contentHash = contentHash
+        self.fields = fields
+        self.useful = useful
+        self.hits = hits
+
+    def done(self):
+        return True
+
+    def result(self):
+        return self.fields, self.useful, {"hits": self.hits} if self.hits is not None else {}
+
+def planDirectory(directory, options, quarantine, seen):
+    # lists the files of a folder and decides which ones have to be classified, without reading them
+    # with --dedup, seen maps the content hash of each file met so far in the run to its path and to the task
+    # giving its row; the pipeline adds the hashes of the files it reads
+    plan = {"directory": directory, "listing": listFiles(directory), "outputFile": outputName(directory)}
+    plan["onlyFiles"] = plan["listing"]
+    if options.shard:
+        plan["onlyFiles"] = [eachFile for eachFile in plan["listing"] if inShard(plan["outputFile"], eachFile, options.shard)]
+    # the outputs of a shard are partial, named outputs/<folder>.shard-<i>-of-<N>.*
+    plan["outputPrefix"] = 'outputs/' + plan["outputFile"] + shardSuffix(options.shard)
+
+    # in incremental mode only the files that are new or changed since the last run are opened
+    plan["manifestPath"] = plan["outputPrefix"] + '.manifest.json'
+    previousManifest = loadManifest(plan["manifestPath"], manifestSettings(options)) if options.incremental else {}
+    # with --save-hits, the hit matrices of the unchanged files from the previous run
+    plan["previousHits"] = loadHits(plan["outputPrefix"] + '.hits.npz') if options.save_hits and options.incremental else {}
+    manifest = plan["manifest"] = {}
+    toProcess = plan["toProcess"] = []
+    plan["quarantined"] = set()
+    # the previous rows of the files whose mtime changed but not their size, reused if their content is the same
+    plan["stored"] = {}
+    for eachFile in plan["onlyFiles"]:
+        fullPath = os.path.join(directory, eachFile)
+        fileStat = os.stat(fullPath)
+        previous = previousManifest.get(eachFile)
+        if unchangedEntry(previous, fileStat):
+            manifest[eachFile] = dict(previous, mtime=fileStat.st_mtime_ns)
+            if options.dedup and previous["hash"] is not None and previous["hash"] not in seen:
+                seen[previous["hash"]] = fullPath, StoredRow(previous["hash"], previous["fields"], previous["useful"],
+                                                             plan["previousHits"].get(eachFile))
+        elif quarantined(quarantine, fullPath, fileStat):
+            # skipped, and without a manifest entry so that it is tried again if it leaves the quarantine
+            plan["quarantined"].add(eachFile)
+        else:
+            manifest[eachFile] = {"size": fileStat.st_size, "mtime": fileStat.st_mtime_ns}
+            if previous and previous["size"] == fileStat.st_size and previous["hash"] is not None and fileType(eachFile):
+                plan["stored"][eachFile] = StoredRow(previous["hash"], previous["fields"], previous["useful"],
+                                                     plan["previousHits"].get(eachFile))
+            toProcess.append(eachFile)
+    return plan
+
+def writeDirectory(plan, results, stats, options):
+    # writes outputs/<outputFile>.<format> for each output format, taking the rows of the classified files
+    # from results in onlyFiles order
+    # a --shard run writes outputs/<folder>.shard-<i>-of-<N>.json instead, with the position of each row
+    manifest = plan["manifest"]
+    outputFormats = [] if options.shard else options.formats
+    outputPaths = [plan["outputPrefix"] + '.' + outputFormat for outputFormat in outputFormats]
+    sinks = [rowSinks.sinks[outputFormat](outputPath, content, numericContent)
+             for outputFormat, outputPath in zip(outputFormats, outputPaths)]
+    positions = {eachFile: position for position, eachFile in enumerate(plan["listing"])}
+    shardRows = []
+
+    usefulFiles = 0
+    profiles = []
+    # with --save-hits, the hit matrices of the files written, those of the unchanged files from the previous run
+    hitsPath = plan["outputPrefix"] + '.hits.npz'
+    previousHits = plan["previousHits"]
+    fileHits = {}
+    for eachFile in plan["onlyFiles"]:
+        info = {}
+        fullPath = os.path.join(plan["directory"], eachFile)
+        if eachFile in plan["quarantined"]:
+            kind = "quarantined"
+        elif "fields" in manifest[eachFile]:
+            kind = "unchanged"
+        else:
+            # classified, a copy of a file met before (--dedup) or, when only the mtime changed, the previous row
+            kind, contentHash, result = next(results)
+            if kind == "unchanged":
+                manifest[eachFile].update(hash=contentHash, fields=result[0], useful=result[1])
+        if kind == "quarantined":
+            fields, useful = failedRow(eachFile), False
+            stats["quarantined"] += 1
+        elif kind == "unchanged":
+            fields, useful = manifest[eachFile]["fields"], manifest[eachFile]["useful"]
+            stats["reused"] += 1
+            if eachFile in previousHits:
+                fileHits[eachFile] = previousHits[eachFile]
+        elif kind == "copy":
+            # the row of the first file with the same content, with this file name
+            stats["duplicateGroups"].setdefault(contentHash, []).append(fullPath)
+            firstRow = result
+            if isinstance(firstRow, isolatedPool.Failure):
+                stats["failed"].append((fullPath, firstRow.reason))
+                stats["quarantine"][os.path.abspath(fullPath)] = dict(manifest.pop(eachFile), reason=firstRow.reason)
+                saveQuarantine(options.quarantine, stats["quarantine"])
+                fields, useful = failedRow(eachFile), False
+            else:
+                fields, useful = [eachFile] + firstRow[0][1:], firstRow[1]
+                if "hits" in firstRow[2]:
+                    fileHits[eachFile] = firstRow[2]["hits"]
+                manifest[eachFile].update(hash=contentHash, fields=fields, useful=useful)
+        else:
+            if isinstance(result, isolatedPool.Failure):
+                # an empty row, and the file goes to the quarantine so that the next runs skip it
+                stats["failed"].append((fullPath, result.reason))
+                stats["quarantine"][os.path.abspath(fullPath)] = dict(manifest.pop(eachFile), reason=result.reason)
+                saveQuarantine(options.quarantine, stats["quarantine"])
+                result = failedRow(eachFile), False, {}
+            fields, useful, info = result
+            if eachFile in manifest:
+                manifest[eachFile].update(hash=info.get("hash", contentHash), fields=fields, useful=useful)
+                stats["classified"] += 1
+            if "hits" in info:
+                fileHits[eachFile] = info["hits"]
+            if "cache" in info:
+                stats[info["cache"]] += 1
+                stats[info["cache"] + "Bytes"] += info["cacheBytes"]
+            if "peakRSS" in info:
+                stats["peakRSS"].append((info["peakRSS"], fullPath))
+            if "topicUnits" in info:
+                stats["topicPartial"].append((fullPath, info["topicUnits"]))
+            for name, (pages, seconds) in info.get("pdfThroughput", {}).items():
+                stats["pdfThroughput"].setdefault(name, [0, 0.0])
+                stats["pdfThroughput"][name][0] += pages
+                stats["pdfThroughput"][name][1] += seconds
+        if useful: usefulFiles += 1
+        clock = profiling.StageClock() if "profile" in info else profiling.noClock
+        for sink in sinks:
+            sink.writeRow(fields)
+        if options.shard:
+            shardRows.append([positions[eachFile], fields, useful])
+        if "profile" in info:
+            clock("write")
+            profile = dict(info["profile"], file=eachFile, cache=info.get("cache", ""), peakRSS=info.get("peakRSS", ""))
+            profile["stages"].update(clock.stages)
+            profiles.append(profile)
+            stats["profile"].add(fullPath, profile)
+
+    for sink, outputPath in zip(sinks, outputPaths):
+        sink.close()
+        if not usefulFiles : os.remove(outputPath)
+    # the shard files are kept without useful files: whether the folder has any is decided when merging
+    if options.shard:
+        saveShard(plan["outputPrefix"] + '.json', options.shard, len(plan["listing"]), shardRows)
+    if options.save_hits and (usefulFiles or options.shard):
+        saveHits(hitsPath, fileHits)
+    if options.profile:
+        profiling.writeProfile(plan["outputPrefix"] + '.profile.csv', profiles)
+    if options.incremental:
+        saveManifest(plan["manifestPath"], manifest, manifestSettings(options))
+
+def writeDuplicateReport(path, seen, duplicateGroups):
+    # one line per file of each group of identical files, the classified one first
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group", "hash", "file", "classified"])
+        for group, (contentHash, paths) in enumerate(duplicateGroups.items(), 1):
+            writer.writerow([group, contentHash, seen[contentHash][0], "yes"])
+            for path in paths:
+                writer.writerow([group, contentHash, path, "no"])
+
+def readFile(path):
+    # the whole content of a file, read by a prefetch thread
+    with open(path, "rb") as f:
+        return f.read()
+
+class InlineTask:
+    # a file classified in this process when its result is first asked for, in the runs without worker processes
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+        self.value = None
+
+    def result(self):
+        # the arguments, which can hold the content read, are dropped once the file is classified
+        if self.args is not None:
+            self.value = self.function(*self.args)
+            self.args = None
+        return self.value
+
+# seconds between the hand-overs of the files read while waiting for an isolated worker
+readPoll = 0.02
+
+class Pipeline:
+    # the results of the tasks (directory, file, size, StoredRow or None, whether to hash it) in order, through three
+    # stages: the reader threads read the files (--prefetch N threads, none to let the workers read them) and hash
+    # those that need it, the executor classifies them and the caller writes the rows; at most options.queue_depth
+    # files, and options.queue_mb megabytes of read content, are between the first and the last stage, so a slow
+    # writer or slow workers stop the reading
+    # files larger than queue_mb are read by their worker
+    # only this thread hands the files to the executor: a process pool forking its workers from a reader thread
+    # can deadlock
+    # each result comes as (kind, content hash or None, result): "classified", "copy" for the result of the first
+    # file with the same content when seen is given (--dedup), or "unchanged" for the StoredRow of the task when the
+    # content did not change
+    def __init__(self, executor, tasks, options, seen=None):
+        self.executor = executor
+        self.tasks = iter(tasks)
+        self.depth = options.queue_depth
+        self.maxBytes = options.queue_mb * 1000000
+        self.prefetch = options.prefetch
+        self.seen = seen
+        # started when a file has to be read or hashed: a single thread hashes the files without --prefetch
+        self.readers = None
+        # {"directory", "file", "size", "stored", "read": future of the content and hash, "kind", "hash",
+        # "task": classification}, in task order; "task" is None until the file is read
+        self.inFlight = collections.deque()
+        self.queuedBytes = 0
+        self.nextTask = None
+        self.readBytes = 0
+        self.readSeconds = 0.0
+        self.readLock = threading.Lock()
+
+    def submit(self, directory, eachFile, data, contentHash):
+        if not self.executor:
+            return InlineTask(measuredProcessFile, directory, eachFile, data, contentHash)
+        return self.executor.submit(measuredProcessFile, directory, eachFile, data, contentHash)
+
+    def read(self, path, keep, hashIt):
+        # runs in a reader thread: the content when it is kept for the worker, and the hash when it is asked for;
+        # a file that cannot be read is left to the worker, which reports the error
+        start = time.perf_counter()
+        try:
+            data = readFile(path) if keep else None
+            contentHash = fileHash(path, data) if hashIt else None
+        except OSError:
+            data, contentHash = None, None
+        with self.readLock:
+            self.readSeconds += time.perf_counter() - start
+        return data, contentHash
+
+    def handOver(self):
+        # gives the files read so far to the executor, unless their row is known already
+        for entry in self.inFlight:
+            if entry["task"] is None and entry["read"].done():
+                data, contentHash = entry["read"].result()
+                entry["read"] = None
+                entry["hash"] = contentHash
+                path = os.path.join(entry["directory"], entry["file"])
+                stored = entry["stored"]
+                if stored is not None and contentHash == stored.contentHash:
+                    entry["kind"], entry["task"] = "unchanged", stored
+                    if self.seen is not None and contentHash not in self.seen:
+                        self.seen[contentHash] = path, stored
+                elif self.seen is not None and contentHash in self.seen:
+                    # the first file with this content is the first one read, which is the one classified
+                    entry["kind"], entry["task"] = "copy", self.seen[contentHash][1]
+                else:
+                    entry["task"] = self.submit(entry["directory"], entry["file"], data, contentHash)
+                    if self.seen is not None and contentHash is not None:
+                        self.seen[contentHash] = path, entry["task"]
+
+    def fill(self):
+        # hands over the files read and starts the next tasks while the queue has room for them
+        self.handOver()
+        while len(self.inFlight) < self.depth:
+            if self.nextTask is None:
+                self.nextTask = next(self.tasks, None)
+                if self.nextTask is None:
+                    return
+            directory, eachFile, size, stored, hashIt = self.nextTask
+            keep = self.prefetch and size <= self.maxBytes
+            entry = {"directory": directory, "file": eachFile, "size": 0, "stored": stored, "read": None,
+                     "kind": "classified", "hash": None, "task": None}
+            if keep or hashIt:
+                if keep:
+                    if self.inFlight and self.queuedBytes + size > self.maxBytes:
+                        return
+                    entry["size"] = size
+                    self.queuedBytes += size
+                    self.readBytes += size
+                if not self.readers:
+                    self.readers = concurrent.futures.ThreadPoolExecutor(self.prefetch or 1)
+                entry["read"] = self.readers.submit(self.read, os.path.join(directory, eachFile), keep, hashIt)
+            else:
+                entry["task"] = self.submit(directory, eachFile, None, None)
+            self.inFlight.append(entry)
+            self.nextTask = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.fill()
+        if not self.inFlight:
+            raise StopIteration
+        first = self.inFlight[0]
+        # while the first file is read or classified by the pool, the other files are handed over as their
+        # reads complete, so that the workers do not wait for the writer
+        while True:
+            reading = [entry["read"] for entry in self.inFlight if entry["task"] is None]
+            task = first["task"]
+            if task is not None and (not reading or isinstance(task, InlineTask) or task.done()):
+                break
+            if isinstance(self.executor, isolatedPool.IsolatedPool):
+                # the isolated workers only run within step(), which cannot wait on the reads: short steps,
+                # with the files read meanwhile handed over in between
+                self.executor.step(readPoll)
+            else:
+                concurrent.futures.wait(reading + ([task] if task is not None else []),
+                                        return_when=concurrent.futures.FIRST_COMPLETED)
+            self.handOver()
+        self.inFlight.popleft()
+        self.queuedBytes -= first["size"]
+        return first["kind"], first["hash"], task.result()
+
+    def close(self):
+        # waits for the reads in progress
+        if self.readers: self.readers.shutdown(cancel_futures=True)
+
+def plannedTasks(directories, options, stats, plans):
+    # plans each folder when the pipeline reaches it, adding the plan to plans, and yields the files to classify
+    for directory in directories:
+        plan = planDirectory(directory, options, stats["quarantine"], stats["seen"])
+        if options.recursive and not plan["listing"]:
+            continue
+        plans.append(plan)
+        for eachFile in plan["toProcess"]:
+            # the files of the other types are not opened, their rows are empty: they are not hashed for --dedup
+            stored = plan["stored"].get(eachFile)
+            yield (directory, eachFile, plan["manifest"][eachFile]["size"], stored,
+                   bool(options.dedup and fileType(eachFile)) or stored is not None)
+
+def processDirectories(directories, options):
+    # classifies each folder into its own workbook, sharing one worker pool for the whole run
+    stats = {"reused": 0, "classified": 0, "hit": 0, "miss": 0, "hitBytes": 0, "missBytes": 0, "pdfThroughput": {},
+             "topicPartial": [], "failed": [], "quarantined": 0, "quarantine": loadQuarantine(options.quarantine),
+             "peakRSS": [], "seen": {}, "duplicateGroups": {},
+             "profile": profiling.RunProfile(options.profile_top)}
+    if options.file_timeout or options.file_memory:
+        # every file is classified in a worker process that is killed when it runs out of time or memory
+        executor = isolatedPool.IsolatedPool(options.jobs, initWorker, (options,), options.file_timeout,
+                                             options.file_memory * 1000000 if options.file_memory else None)
+    elif options.jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs, initializer=initWorker, initargs=(options,))
+    else:
+        executor = None
+        initWorker(options)
+    plans = collections.deque()
+    # the rows come in the order of the files, so the worksheets are the same as in a serial run; the files of
+    # the next folders are read and classified while a folder is written, so the workers do not wait at the
+    # folder boundaries
+    pipeline = Pipeline(executor, plannedTasks(directories, options, stats, plans), options,
+                        stats["seen"] if options.dedup else None)
+    try:
+        while True:
+            pipeline.fill()
+            if not plans:
+                break
+            writeDirectory(plans.popleft(), pipeline, stats, options)
+    finally:
+        pipeline.close()
+        if executor: executor.shutdown(cancel_futures=True)
+
+    if options.incremental:
+        print("incremental: %d files reused, %d files classified" % (stats["reused"], stats["classified"]))
+    if options.dedup:
+        copies = sum(len(paths) for paths in stats["duplicateGroups"].values())
+        print("dedup: %d files with the content of %d files classified once" % (copies, len(stats["duplicateGroups"])))
+    if options.duplicate_report:
+        writeDuplicateReport(options.duplicate_report, stats["seen"], stats["duplicateGroups"])
+    if options.prefetch:
+        print("prefetch: %.1f MB read in %.1fs by %d threads" % (pipeline.readBytes / 1e6, pipeline.readSeconds, options.prefetch))
+    for path, reason in stats["failed"]:
+        print("failed: %s (%s), added to %s" % (path, reason, options.quarantine))
+    if stats["quarantined"]:
+        print("quarantine: %d files skipped, listed in %s" % (stats["quarantined"], options.quarantine))
+    for path, topicUnits in stats["topicPartial"]:
+        print("topic budget reached: topics of %s counted on its first %d text units" % (path, topicUnits))
+    if stats["peakRSS"]:
+        peaks = sorted(stats["peakRSS"])
+        print("peak RSS per file: median %.1f MB, largest %.1f MB (%s)" % (
+            peaks[len(peaks) // 2][0] / 1e6, peaks[-1][0] / 1e6, peaks[-1][1]))
+    for name, (pages, seconds) in stats["pdfThroughput"].items():
+        print("pdf backend %s: %d pages in %.1fs (%.1f pages/s)" % (name, pages, seconds, pages / seconds if seconds else 0))
+    if options.cache_dir:
+        print("extraction cache: %d hits, %d misses, %d bytes read, %d bytes written, %d bytes in cache" % (
+            stats["hit"], stats["miss"], stats["hitBytes"], stats["missBytes"],
+            ExtractionCache(options.cache_dir, options.cache_size * 1000000).size()))
+    if options.profile:
+        stats["profile"].report()
+
+def addClassificationOptions(parser):
+    # the options initWorker reads to classify a file, shared with classifyServer.py
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="keep the text extracted from each file in DIR and reuse it when the file content did not change")
+    parser.add_argument("--cache-size", type=int, default=2048, metavar="MB",
+                        help="maximum size of the extraction cache, least recently used entries are removed first (default: 2048)")
+    parser.add_argument("--pdf-backend", choices=sorted(pdfBackends), default="fast",
+                        help="PDF text extraction: plain pdfminer text (fast) or pdfplumber; "
+                             "pdfplumber is also used when the fast backend finds no text (default: fast)")
+    parser.add_argument("--topic-chars", type=int, default=topicChars, metavar="N",
+                        help="count the topics of each file on its first N characters of text (default: %d)" % topicChars)
+    parser.add_argument("--topic-seconds", type=float, metavar="S",
+                        help="stop counting the topics of a file after S seconds; the rows then depend on the machine load")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preclassify PPTX, DOCX, PDF from training data")
+    parser.add_argument("directories", nargs="+", metavar="directory", help="folder with the files to classify")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also classify every folder below the given ones, each into its own workbook")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="number of worker processes used to classify the files (default: 1)")
+    addClassificationOptions(parser)
+    parser.add_argument("--prefetch", type=int, default=0, metavar="N",
+                        help="read the files ahead in N threads and hand their content to the workers, so that slow "
+                             "(network) reads overlap with the classification (default: 0, the workers read the files)")
+    parser.add_argument("--queue-depth", type=int, metavar="N",
+                        help="files read or classified ahead of the row writing (default: 4 per worker)")
+    parser.add_argument("--queue-mb", type=int, default=256, metavar="MB",
+                        help="content read ahead held in memory at once; larger files are read by the workers (default: 256)")
+    parser.add_argument("--shard", type=parseShard, metavar="i/N",
+                        help="classify only the i-th of N slices of the files, chosen by their relative path, and write "
+                             "outputs/<folder>.shard-<i>-of-<N>.json; mergeShards.py combines the N shards")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only classify the files added or changed since the last --incremental run, using the manifest "
+                             "stored next to the output; run once without it after changing the classification rules")
+    parser.add_argument("--file-timeout", type=float, metavar="S",
+                        help="classify each file in a separate worker process and give up on a file after S seconds")
+    parser.add_argument("--file-memory", type=int, metavar="MB",
+                        help="classify each file in a separate worker process limited to MB megabytes of address space")
+    parser.add_argument("--quarantine", default="outputs/quarantine.json", metavar="FILE",
+                        help="list of the files that failed or ran out of time or memory, which later runs skip until "
+                             "they change (default: outputs/quarantine.json)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="hash every PPTX, DOCX, PDF and XLSX file and classify each content once in the run: identical copies, in any folder, "
+                             "get the row of the one read first with their own file name")
+    parser.add_argument("--duplicate-report", metavar="FILE",
+                        help="with --dedup, write the groups of identical files to the CSV file FILE")
+    parser.add_argument("--save-hits", action="store_true",
+                        help="save which text units match which topic query in outputs/<folder>.hits.npz, "
+                             "from which topicsFromHits decides the topics again without opening the files")
+    parser.add_argument("--profile", action="store_true",
+                        help="record the wall and CPU time of every stage for each file in outputs/<folder>.profile.csv "
+                             "and print the stage totals and the slowest files at the end")
+    parser.add_argument("--profile-top", type=int, default=10, metavar="N",
+                        help="number of slowest files printed with --profile (default: 10)")
+    parser.add_argument("--format", dest="formats", action="append", choices=sorted(rowSinks.sinks),
+                        help="output format, can be given more than once: xlsx, csv, jsonl, or parquet when pyarrow "
+                             "is installed (default: xlsx)")
+    args = parser.parse_intermixed_args()
+    args.formats = list(dict.fromkeys(args.formats or ["xlsx"]))
+    if args.jobs < 1:
+        parser.error("--jobs needs at least 1 worker")
+    if args.prefetch < 0:
+        parser.error("--prefetch cannot be negative")
+    if args.queue_depth is not None and args.queue_depth < 1:
+        parser.error("--queue-depth needs at least 1 file")
+    args.queue_depth = args.queue_depth or 4 * args.jobs
+    for outputFormat in args.formats:
+        if not rowSinks.available(outputFormat):
+            parser.error("the %s output needs pyarrow" % outputFormat)
+    if args.shard and not 1 <= args.shard[0] <= args.shard[1]:
+        parser.error("--shard i/N needs 1 <= i <= N")
+    if args.duplicate_report and not args.dedup:
+        parser.error("--duplicate-report needs --dedup")
+    if args.recursive:
+        directories = (directory for root in args.directories for directory in walkDirectories(root))
     else:
-        # assigns the topic to the concept with most matches
-        fields[6] = topics[maxMatchesIndexes[0]]
-        # if the topic is in the patent law concepts check the title
-        if maxMatchesIndexes[0] > 5 and maxMatchesIndexes[0] < 14:
-            titleMatches = [''] * 8
-            titleMatches[0] = get_amendments([fields[2]])[0]
-            titleMatches[1] = get_clarity([fields[2]])[0]
-            titleMatches[2] = get_exclusions([fields[2]])[0]
-            titleMatches[3] = get_inventiveness([fields[2]])[0]
-            titleMatches[4] = get_novelty([fields[2]])[0]
-            titleMatches[5] = get_priority([fields[2]])[0]
-            titleMatches[6] = get_sufficiency([fields[2]])[0]
-            titleMatches[7] = get_unity([fields[2]])[0]
-            # check if there is only one matching concept in the title
-            nonNullMatches = [i for i, j in enumerate(titleMatches) if j > 0]
-#            print(nonNullMatches)
-            # if only one found, assign the topic to that one
-            if len(nonNullMatches) == 1:
-                fields[6] = topics[6 + nonNullMatches[0]]
-            # if there are multiple matching concepts, check if the fulltext matches one more than 3x the other ones
-            # we know already from the checks at the beginning that only one field has the max value
-            if len(nonNullMatches) > 1 or len(nonNullMatches) == 0:
-                for i, j in enumerate(fields[14:21]):
-            # if any value is higher than 1/3 the max, assign generic topic
-                    if j > maxMatches/3 and i != (maxMatchesIndexes[0] - 6):
-                        fields[6] = "Patent law concepts|493f6ca1-16fd-4f96-bcd7-e46f81984678"
-
-    column = 0
-    for field in fields:
-#        print(row, " ", column, " ", field)
-        worksheet.write(row, column, field)
-        column += 1
-
-    row += 1
-
-workbook.close()
-if not usefulFiles : os.remove('outputs/' + outputFile + '.xlsx')
+        directories = args.directories
+    processDirectories(directories, args)
@@ -0,0 +1,145 @@
+import collections
+import multiprocessing
+import multiprocessing.connection
+import resource
+import time
+
+# worker processes running one task at a time, each under a wall-clock timeout and an address space limit:
+# a worker that runs out of time is killed and replaced, so one file cannot stall or take down the whole run
+
+
+class IsolatedTask:
+    # a queued task, whose result() waits for it like Future.result and can be asked for again
+    def __init__(self, pool, taskId):
+        self.pool = pool
+        self.taskId = taskId
+        self.finished = False
+        self.value = None
+
+    def done(self):
+        return self.finished or self.taskId in self.pool.results
+
+    def result(self):
+        if not self.finished:
+            self.value = self.pool.result(self.taskId)
+            self.finished = True
+        return self.value
+
+class Failure:
+    # the result of a task that did not complete, with the reason
+    def __init__(self, reason):
+        self.reason = reason
+
+def workerLoop(connection, initializer, initargs, memoryLimit):
+    if memoryLimit:
+        resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, memoryLimit))
+    if initializer:
+        initializer(*initargs)
+    while True:
+        task = connection.recv()
+        if task is None:
+            return
+        function, args = task
+        try:
+            result = (True, function(*args))
+        except MemoryError:
+            # answered after the except clause, once the frames of the failed call are released
+            result = None
+        except Exception as error:
+            result = (False, "%s: %s" % (type(error).__name__, error))
+        if result is None:
+            result = (False, "memory limit of %d MB exceeded" % (memoryLimit // 1000000) if memoryLimit else "out of memory")
+        connection.send(result)
+
+def startWorker(initializer=None, initargs=(), memoryLimit=None, context=multiprocessing):
+    # a process running workerLoop and the parent end of its connection
+    parentEnd, childEnd = context.Pipe()
+    process = context.Process(target=workerLoop, daemon=True, args=(childEnd, initializer, initargs, memoryLimit))
+    process.start()
+    childEnd.close()
+    return process, parentEnd
+
+class IsolatedPool:
+    def __init__(self, jobs, initializer=None, initargs=(), timeout=None, memoryLimit=None):
+        self.jobs = jobs
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.memoryLimit = memoryLimit
+        self.queue = collections.deque()
+        self.results = {}
+        self.nextTask = 0
+        self.idle = []
+        # connection -> (process, task id, deadline)
+        self.busy = {}
+
+    def submit(self, function, *args):
+        # queues one task, like Executor.submit; a task that failed, ran out of time or killed its worker gives a Failure
+        taskId = self.nextTask
+        self.nextTask += 1
+        self.queue.append((taskId, function, args))
+        return IsolatedTask(self, taskId)
+
+    def result(self, taskId):
+        while taskId not in self.results:
+            self.step()
+        return self.results.pop(taskId)
+
+    def step(self, maxWait=None):
+        # hands queued tasks to free workers, then waits for a result or the first deadline, at most maxWait seconds
+        while self.queue and len(self.busy) < self.jobs:
+            taskId, function, args = self.queue.popleft()
+            process, connection = self.idle.pop() if self.idle else startWorker(
+                self.initializer, self.initargs, self.memoryLimit)
+            connection.send((function, args))
+            deadline = time.monotonic() + self.timeout if self.timeout else None
+            self.busy[connection] = (process, taskId, deadline)
+        deadlines = [deadline for process, taskId, deadline in self.busy.values() if deadline]
+        waitTime = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        if maxWait is not None:
+            waitTime = maxWait if waitTime is None else min(waitTime, maxWait)
+        for connection in multiprocessing.connection.wait(list(self.busy), waitTime):
+            process, taskId, deadline = self.busy.pop(connection)
+            try:
+                completed, value = connection.recv()
+            except (EOFError, OSError):
+                process.join()
+                if process.exitcode < 0:
+                    self.results[taskId] = Failure("worker killed by signal %d" % -process.exitcode)
+                else:
+                    self.results[taskId] = Failure("worker exited with code %d" % process.exitcode)
+                connection.close()
+                continue
+            if completed:
+                self.results[taskId] = value
+                self.idle.append((process, connection))
+            else:
+                # a worker is not reused after a failure
+                self.results[taskId] = Failure(value)
+                process.kill()
+                process.join()
+                connection.close()
+        now = time.monotonic()
+        for connection, (process, taskId, deadline) in list(self.busy.items()):
+            if deadline and now >= deadline:
+                process.kill()
+                process.join()
+                connection.close()
+                del self.busy[connection]
+                self.results[taskId] = Failure("timeout after %g s" % self.timeout)
+
+    def shutdown(self, cancel_futures=True):
+        # same call as Executor.shutdown; the queued tasks are always dropped
+        self.queue.clear()
+        for process, connection in self.idle:
+            connection.send(None)
+            connection.close()
+        for connection, (process, taskId, deadline) in self.busy.items():
+            process.kill()
+            connection.close()
+        for process, connection in self.idle:
+            process.join()
+        for process, taskId, deadline in self.busy.values():
+            process.join()
+        self.idle = []
+        self.busy = {}
@@ -0,0 +1,58 @@
+import hashlib
+
+# language of a document from a bounded sample of its text: languageParts pieces spread over all its units,
+# languageBudget characters in total, given to the detector one piece at a time until it is reliable
+
+# TextBudget extracts at least languageUnits units, so that the sample is not taken from a few units only
+languageUnits = 150
+languageBudget = 2000
+languageParts = 4
+# detected languages by sample hash, so documents with the same text are detected once per process
+languageCacheSize = 10000
+languageCache = {}
+
+
+class PrintableTable(dict):
+    # str.translate table dropping the characters str.isprintable rejects, filled as the characters are met
+    def __missing__(self, code):
+        self[code] = code if chr(code).isprintable() else None
+        return self[code]
+
+printable = PrintableTable()
+
+def languageSample(onlyText):
+    # the whole text when it fits in the budget, otherwise one piece starting at each of languageParts
+    # evenly spaced units of the whole document, each taking units until it has its share of the budget
+    units = onlyText
+    if sum(len(unit) for unit in units) <= languageBudget:
+        return [" ".join(units).translate(printable)]
+    share = languageBudget // languageParts
+    pieces = []
+    for part in range(languageParts):
+        piece = []
+        size = 0
+        for unit in units[part * len(units) // languageParts:]:
+            text = unit[:share - size].translate(printable)
+            piece.append(text)
+            size += len(text) + 1
+            if size >= share:
+                break
+        pieces.append(" ".join(piece))
+    return pieces
+
+def detectLanguage(onlyText):
+    from polyglot.detect import Detector
+    pieces = languageSample(onlyText)
+    key = hashlib.sha1("\0".join(pieces).encode("utf-8")).digest()
+    if key in languageCache:
+        return languageCache[key]
+    sample = ""
+    for piece in pieces:
+        sample = sample + " " + piece if sample else piece
+        detector = Detector(sample, quiet=True)
+        if detector.reliable:
+            break
+    if len(languageCache) >= languageCacheSize:
+        languageCache.clear()
+    languageCache[key] = detector.language.code.upper()
+    return languageCache[key]
@@ -0,0 +1,87 @@
+import os
+import re
+import json
+import argparse
+
+import findTags2
+import rowSinks
+
+# combines the outputs of the findTags2.py --shard i/N runs, outputs/<folder>.shard-<i>-of-<N>.json, into the
+# outputs a single run writes: the rows of every shard in the file order of the folder, no workbook when no file
+# is useful, and the --save-hits matrices of the shards in one outputs/<folder>.hits.npz
+
+shardName = re.compile(r"^(.+)\.shard-(\d+)-of-(\d+)\.json$")
+
+
+def findShards(outputDirectory):
+    # {folder output name: {shard count: {shard index: path}}}
+    shards = {}
+    for name in sorted(os.listdir(outputDirectory)):
+        match = shardName.match(name)
+        if match:
+            outputFile, index, count = match.group(1), int(match.group(2)), int(match.group(3))
+            shards.setdefault(outputFile, {}).setdefault(count, {})[index] = os.path.join(outputDirectory, name)
+    return shards
+
+def loadRows(paths):
+    # the rows of all the shards in the order of the folder, or None when the shards do not cover the same listing
+    rows, listed = [], set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            shard = json.load(f)
+        rows.extend(shard["rows"])
+        listed.add(shard["listed"])
+    rows.sort(key=lambda row: row[0])
+    if len(listed) != 1 or [row[0] for row in rows] != list(range(listed.pop())):
+        return None
+    return rows
+
+def mergeFolder(outputDirectory, outputFile, count, paths, formats):
+    # writes the outputs of one folder like findTags2.writeDirectory; returns the number of useful files
+    rows = loadRows(paths.values())
+    if rows is None:
+        return None
+    prefix = os.path.join(outputDirectory, outputFile)
+    usefulFiles = sum(1 for position, fields, useful in rows if useful)
+    for outputFormat in formats:
+        outputPath = prefix + "." + outputFormat
+        sink = rowSinks.sinks[outputFormat](outputPath, findTags2.content, findTags2.numericContent)
+        for position, fields, useful in rows:
+            sink.writeRow(fields)
+        sink.close()
+        if not usefulFiles : os.remove(outputPath)
+
+    fileHits = {}
+    for index in paths:
+        fileHits.update(findTags2.loadHits(prefix + findTags2.shardSuffix((index, count)) + ".hits.npz"))
+    if fileHits and usefulFiles:
+        findTags2.saveHits(prefix + ".hits.npz", {fields[0]: fileHits[fields[0]] for position, fields, useful in rows
+                                                  if fields[0] in fileHits})
+    return usefulFiles
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the outputs of findTags2.py --shard runs")
+    parser.add_argument("--outputs", default="outputs", metavar="DIR",
+                        help="folder with the shard outputs, where the merged outputs are written (default: outputs)")
+    parser.add_argument("--format", dest="formats", action="append", choices=sorted(rowSinks.sinks),
+                        help="output format, can be given more than once, as in findTags2.py (default: xlsx)")
+    args = parser.parse_args()
+    args.formats = list(dict.fromkeys(args.formats or ["xlsx"]))
+    for outputFormat in args.formats:
+        if not rowSinks.available(outputFormat):
+            parser.error("the %s output needs pyarrow" % outputFormat)
+
+    for outputFile, counts in findShards(args.outputs).items():
+        if len(counts) > 1:
+            print("skipped %s: shards of runs with %s shards" % (outputFile, " and ".join(str(count) for count in sorted(counts))))
+            continue
+        count, paths = counts.popitem()
+        missing = [str(index) for index in range(1, count + 1) if index not in paths]
+        if missing:
+            print("skipped %s: shard %s of %d missing" % (outputFile, ", ".join(missing), count))
+            continue
+        usefulFiles = mergeFolder(args.outputs, outputFile, count, paths, args.formats)
+        if usefulFiles is None:
+            print("skipped %s: the shards were run on different files" % outputFile)
+        else:
+            print("%s: %d shards merged, %d useful files" % (outputFile, count, usefulFiles))
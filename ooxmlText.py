@@ -0,0 +1,119 @@
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+# reads the text of .pptx/.docx files straight from the zip, stream-parsing only the slide or document parts,
+# with the same result as python-pptx shape.text and python-docx paragraph.text
+
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# the children of p:spTree that python-pptx turns into shapes; only p:sp shapes have a text attribute
+shapeTags = {P + "sp", P + "grpSp", P + "graphicFrame", P + "cxnSp", P + "pic", P + "contentPart"}
+# text of the w:r children python-docx joins into the run text
+runText = {W + "tab": "\t", W + "ptab": "\t", W + "cr": "\n", W + "noBreakHyphen": "-"}
+
+
+def relationships(archive, partName):
+    # maps relationship id to (type, target part name) for the rels of partName
+    relsName = posixpath.join(posixpath.dirname(partName), "_rels", posixpath.basename(partName) + ".rels")
+    found = {}
+    with archive.open(relsName) as f:
+        for rel in ET.parse(f).getroot().iter(REL + "Relationship"):
+            if rel.get("TargetMode") == "External":
+                continue
+            target = rel.get("Target")
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(partName), target))
+            found[rel.get("Id")] = (rel.get("Type"), target)
+    return found
+
+def mainPart(archive):
+    for relType, target in relationships(archive, "").values():
+        if relType.endswith("/officeDocument"):
+            return target
+    raise KeyError("no main document part")
+
+def slideParts(archive):
+    # slide part names in presentation order, from the p:sldIdLst of the presentation part
+    presentation = mainPart(archive)
+    rels = relationships(archive, presentation)
+    with archive.open(presentation) as f:
+        root = ET.parse(f).getroot()
+    return [rels[sldId.get(R + "id")][1] for sldId in root.iterfind(P + "sldIdLst/" + P + "sldId")]
+
+def slideShapeTexts(archive, partName):
+    # text of each shape of the slide that has one, in document order; runs, fields and line breaks (as \v)
+    # of each paragraph are joined, and the paragraphs are joined with \n
+    texts = []
+    tags = []
+    with archive.open(partName) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                tags.append(elem.tag)
+                if len(tags) == 4 and tags[1:] == [P + "cSld", P + "spTree", P + "sp"]:
+                    paragraphs = []
+                elif len(tags) == 6 and tags[1:] == [P + "cSld", P + "spTree", P + "sp", P + "txBody", A + "p"]:
+                    paragraphs.append([])
+                continue
+            tags.pop()
+            depth = len(tags)
+            if depth == 6 and tags[1:] == [P + "cSld", P + "spTree", P + "sp", P + "txBody", A + "p"]:
+                if elem.tag == A + "br":
+                    paragraphs[-1].append("\v")
+                elif elem.tag in (A + "r", A + "fld"):
+                    t = elem.find(A + "t")
+                    paragraphs[-1].append((t.text or "") if t is not None else "")
+            elif depth == 3 and tags[1:] == [P + "cSld", P + "spTree"] and elem.tag in shapeTags:
+                if elem.tag == P + "sp":
+                    texts.append("\n".join("".join(p) for p in paragraphs))
+                elem.clear()
+    return texts
+
+def iterSlideShapeTexts(path):
+    # for each slide in order, the list of its shape texts; returns the slide count and the generator
+    archive = zipfile.ZipFile(path)
+    parts = slideParts(archive)
+
+    def slides():
+        with archive:
+            for partName in parts:
+                yield slideShapeTexts(archive, partName)
+    return len(parts), slides()
+
+def documentParagraphs(path):
+    # text of the paragraphs directly in the document body, in order
+    paragraphs = []
+    tags = []
+    with zipfile.ZipFile(path) as archive:
+        for event, elem in ET.iterparse(archive.open(mainPart(archive)), events=("start", "end")):
+            if event == "start":
+                tags.append(elem.tag)
+                if len(tags) == 3 and tags[1:] == [W + "body", W + "p"]:
+                    paragraphs.append([])
+                continue
+            tags.pop()
+            depth = len(tags)
+            if depth == 3 and elem.tag == W + "r" and tags[1:] == [W + "body", W + "p"]:
+                paragraphs[-1].append(wordRunText(elem))
+            elif depth == 4 and elem.tag == W + "r" and tags[1:] == [W + "body", W + "p", W + "hyperlink"]:
+                paragraphs[-1].append(wordRunText(elem))
+            elif depth == 2:
+                elem.clear()
+    return ["".join(p) for p in paragraphs]
+
+def wordRunText(run):
+    text = []
+    for child in run:
+        if child.tag == W + "t":
+            text.append(child.text or "")
+        elif child.tag == W + "br":
+            text.append("\n" if child.get(W + "type", "textWrapping") == "textWrapping" else "")
+        elif child.tag in runText:
+            text.append(runText[child.tag])
+    return "".join(text)
@@ -0,0 +1,89 @@
+import csv
+import heapq
+import resource
+import time
+
+# per-file wall and CPU time of each classification stage, recorded with --profile, and peak memory of each file
+
+stages = ["open", "filter", "material", "language", "topics", "title", "write"]
+
+
+class StageClock:
+    # each call adds the wall and CPU seconds since the previous call to the named stage
+    def __init__(self):
+        self.stages = {}
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+
+    def __call__(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        previousWall, previousCPU = self.stages.get(name, (0.0, 0.0))
+        self.stages[name] = (previousWall + wall - self.wall, previousCPU + cpu - self.cpu)
+        self.wall, self.cpu = wall, cpu
+
+def noClock(name):
+    pass
+
+def resetPeakRSS():
+    # starts a new peak resident set size measure for this process (Linux only)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peakRSS():
+    # peak resident set size in bytes since resetPeakRSS, or since the process started where it cannot be reset
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def totals(record):
+    return sum(wall for wall, cpu in record["stages"].values()), sum(cpu for wall, cpu in record["stages"].values())
+
+def writeProfile(path, records):
+    # one line per classified file: size in bytes, text units, pages, cache use and the seconds of every stage
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "size", "units", "pages", "cache", "peak rss"] +
+                        [stage + suffix for stage in stages + ["total"] for suffix in (" wall", " cpu")])
+        for record in records:
+            times = [record["stages"].get(stage, (0.0, 0.0)) for stage in stages] + [totals(record)]
+            writer.writerow([record["file"], record["size"], record["units"], record["pages"], record.get("cache", ""),
+                             record.get("peakRSS", "")] +
+                            ["%.6f" % seconds for wall, cpu in times for seconds in (wall, cpu)])
+
+class RunProfile:
+    # stage totals and the slowest files of the whole run
+    def __init__(self, top):
+        self.top = top
+        self.files = 0
+        self.slowest = []
+        self.stageTotals = {stage: [0.0, 0.0] for stage in stages}
+
+    def add(self, path, record):
+        self.files += 1
+        for stage, (wall, cpu) in record["stages"].items():
+            self.stageTotals[stage][0] += wall
+            self.stageTotals[stage][1] += cpu
+        entry = (totals(record)[0], self.files, path, record)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def report(self):
+        wallTotal = sum(wall for wall, cpu in self.stageTotals.values())
+        print("profile: %d files, %.1fs wall, %.1fs cpu" % (
+            self.files, wallTotal, sum(cpu for wall, cpu in self.stageTotals.values())))
+        for stage in stages:
+            wall, cpu = self.stageTotals[stage]
+            print("  %-9s %9.2fs wall %9.2fs cpu %5.1f%%" % (stage, wall, cpu, 100 * wall / wallTotal if wallTotal else 0))
+        if self.slowest:
+            print("slowest files:")
+        for wall, order, path, record in sorted(self.slowest, reverse=True):
+            print("  %9.2fs %6s units %6s pages %10d bytes  %s" % (wall, record["units"], record["pages"], record["size"], path))
@@ -0,0 +1,91 @@
+import csv
+import json
+
+# writers of the output rows, one row at a time: each sink is opened with the header and the names of the
+# numeric columns, and keeps at most a small batch of rows in memory
+# rows are lists with one value per header column; None and "" are empty cells
+
+
+class XlsxSink:
+    # xlsxwriter in constant memory mode writes each row to a temporary file as soon as the next one starts
+    def __init__(self, path, header, numericColumns=()):
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.worksheet = self.workbook.add_worksheet()
+        self.row = 0
+        self.writeRow(header)
+
+    def writeRow(self, fields):
+        self.worksheet.write_row(self.row, 0, fields)
+        self.row += 1
+
+    def close(self):
+        self.workbook.close()
+
+class CsvSink:
+    def __init__(self, path, header, numericColumns=()):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writeRow(header)
+
+    def writeRow(self, fields):
+        self.writer.writerow(["" if field is None else field for field in fields])
+
+    def close(self):
+        self.file.close()
+
+class JsonLinesSink:
+    # one JSON object per row, keyed by the header names
+    def __init__(self, path, header, numericColumns=()):
+        self.file = open(path, "w", encoding="utf-8")
+        self.header = header
+
+    def writeRow(self, fields):
+        self.file.write(json.dumps(dict(zip(self.header, fields)), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class ParquetSink:
+    # numbers are int64 columns and the rest strings; empty cells are nulls
+    batchRows = 1000
+
+    def __init__(self, path, header, numericColumns=()):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.header = header
+        self.numeric = [name in numericColumns for name in header]
+        self.schema = pyarrow.schema([(name, pyarrow.int64() if numeric else pyarrow.string())
+                                      for name, numeric in zip(header, self.numeric)])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def writeRow(self, fields):
+        self.rows.append([None if field == "" or field is None else field if numeric else str(field)
+                          for field, numeric in zip(fields, self.numeric)])
+        if len(self.rows) >= self.batchRows:
+            self.flush()
+
+    def flush(self):
+        columns = zip(*self.rows)
+        self.writer.write_table(self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if self.rows:
+            self.flush()
+        self.writer.close()
+
+sinks = {"xlsx": XlsxSink, "csv": CsvSink, "jsonl": JsonLinesSink, "parquet": ParquetSink}
+
+def available(outputFormat):
+    # parquet needs pyarrow, which is optional
+    if outputFormat != "parquet":
+        return True
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
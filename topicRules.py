@@ -0,0 +1,270 @@
+import re
+import time
+try:
+    from re import _parser as sreParse
+except ImportError:
+    import sre_parse as sreParse
+
+# type of material, reported when any text unit matches
+materialRules = [
+    ("Exercise|cac0e695-c696-42d9-acac-27fc80b91501; ", 'exercises?'),
+    ("Exercise - solutions|68e2a42d-6972-42be-bc70-6af1335b444c; ", 'exercise.{,5}solution'),
+    ("Case study|4e679404-4a79-4ace-9bdb-d5f72cd66b0d; ", 'case stud'),
+    ("Cheat sheet|833de978-768a-4a78-a2fa-1f4bebe0d6a7; ", 'cheat sheet'),
+    ("Mock|eba4b3c5-2cd7-41bc-b7fd-487d6d5586d5; ", 'mock'),
+    ]
+
+# topics counted as the number of text units matching the query
+simpleRules = [
+    ("ip_strategy", '(?:ip|intellectual property).{1,4}strat?g??'),
+    ("patent_licencing", 'li[cs]en[csz]'),
+    ("patent_landscape", 'landscap'),
+    ("patent_valuation", '(?:valuation|bewert|valoris)'),
+    ("boa_decisions", '[gtj][, ][0-9][0-9][0-9][0-9]/[0-9][0-9]'),
+    ("classification", 'classif'),
+    ("PCT", '(?:chapter I|chapter II|PCT procedure)'),
+    ("national", '(?:national|NATL|USPTO|CIPO|SIPO|KIPO|JPO|INPI|DPMA)'),
+    ("litigation", '(?:litig+|infring|contre.?fa)'),
+    ("enforcement", 'enforcement?'),
+    ("revocation", 'r.?vo.?at'),
+    ("eqe", '(?:eqe|apec)'),
+    ("diversity", '(?:D&I|diversity(?:-| | and )?incl)'),
+    ("data_protection", '(?:DPO|GDPR|data protection)'),
+    ("wellbeing", '(?:well.?be|mental.?health)'),
+    ]
+
+# patent law concepts: a query for the EPC references, one for the general terms and one for the PCT references,
+# each counted separately; the column holds the sum of the three and the references are reported above thresholdMatches
+conceptRules = [
+    ("amendments",
+     '(?:(?:A|Art).{0,10}(?:123|76)|(?:richtlinie|guideline|directive|GL) ?H)',
+     'amendment',
+     '(?:A|Art).{0,10}(?:19\\(2\\)|34\\(2.?b\\)).?PCT',
+     "Art. 123 EPC; Art. 76 EPC; ", "Art. 19(2) PCT, Art. 34(2)(b) PCT; "),
+    ("clarity",
+     '(?:(?:A|Art).{0,10}84|F-IV.{0,3}4|(?:richtlinie|guideline|directive|GL) ?F[- ]?IV.{0,3}4)',
+     '(?:clarity|suff.+ (of)? disclos|broad claim|lack of support|concise)',
+     '(?:A|Art).{0,10}6.?PCT',
+     "Art. 84 EPC; ", "Art. 6 PCT; "),
+    ("exclusions",
+     '(?:(?:A|Art).{0,10}53|(?:r|rule|regle|regel).{0,10}(?:28|29)|(?:richtlinie|guideline|directive|GL) ?G[- ]?II.{0,3}[345])',
+     '(?:(?:exception|exclusion).{1,5}patentability|ordre public|treatments?(?:\\s\\S){0,4} bod|(?:surgery|therapy|diagnostic)(?:\\s\\S){0,4} (?:human|animal)|human embryo|clon.{1,3}(?:\\s\\S){0,2} human|human(?:\\s\\S){0,4} clon.{1,3})',
+     '(?:A|Art).(?:9\\.1|39\\.1|67\\.1).{0,8}PCT',
+     "Art. 53 EPC; Rule 28 EPC; Rule 29 EPC; ", "Art. 9.1 PCT; Rule 39.1 PCT; Rule 67.1 PCT; "),
+    ("inventiveness",
+     '(?:(?:A|Art).{0,10}56|(?:richtlinie|guideline|directive|GL) ?G[- ]?VII[^IV])',
+     '(?:inventive step|inventiveness|erfinderische Tätigkeit|activité inventive)',
+     '(?:A|Art).{0,10}33.3.{0,8}PCT',
+     "Art. 56 EPC; ", "Art. 33(3) PCT; "),
+    ("novelty",
+     '(?:(?:A|Art).{0,10}54|F-IV|(?:richtlinie|guideline|directive|GL) ?F[- ]?IV)',
+     '(?:novelty|nouveauté|neuheit)',
+     '(?:R|Rule).{0,10}33\\.1.?[abc].{0,10}PCT',
+     "Art. 54 EPC; ", "Art. 33.1 PCT; "),
+    ("priority",
+     '(?:(?:A|Art).{0,10}(?:87|88|89)|F-VI[^IV]|(?:richtlinie|guideline|directive|GL) ?F[- ]?VI[^IV])',
+     '(?:priority|priorität|priorité|state of the art|stand der technik|art antérieur)',
+     '(?:(?:A|Art).{0,10}8 ?PCT|(?:R|Rule).{0,10}64\\.1.?PCT)',
+     "Art. 87 EPC; Art. 88 EPC; Art. 89 EPC; ", "Art. 8 PCT; Rule 64.1 PCT; "),
+    ("sufficiency",
+     '(?:(?:A|Art).{0,10}83|(?:richtlinie|guideline|directive|GL) ?F[- ]?III)',
+     '(?:F-III|sufficien.{1,3}(?:\\s\\S){0,3} disclos|offenbarung)',
+     '(?:A|Art).{0,10}5 ?PCT',
+     "Art. 83 EPC; ", "Art. 5 PCT; "),
+    ("unity",
+     '(?:(?:A|Art).{0,10}82|(?:richtlinie|guideline|directive|GL) ?F[- ]?V[^IV]|F-V[^IV])',
+     '(?:G ?2/92|unity of invention|require.{1,5}(?:\\s\\S){0,2} unity|einheitlichkeit|unité)',
+     '(?:A|Art).{0,10}13\\.1 ?PCT',
+     "Art. 82 EPC; ", "Art. 13.1 PCT; "),
+    ]
+
+# order of the topic columns fields[8:31]
+columns = [
+    "ip_strategy", "patent_licencing", "patent_landscape", "patent_valuation", "boa_decisions", "classification",
+    "amendments", "clarity", "exclusions", "inventiveness", "novelty", "priority", "sufficiency", "unity", "PCT",
+    "national", "litigation", "enforcement", "revocation", "eqe", "diversity", "data_protection", "wellbeing"]
+
+# all the queries in one flat list, the material ones first; a rule is the index of its query in this list
+names = ([label for label, pattern in materialRules] + [name for name, pattern in simpleRules]
+         + [name + suffix for name, *rest in conceptRules for suffix in ("_epc", "_general", "_pct")])
+queries = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    [pattern for label, pattern in materialRules] + [pattern for name, pattern in simpleRules]
+    + [pattern for name, epc, general, pct, epcRef, pctRef in conceptRules for pattern in (epc, general, pct)])]
+rule = {name: i for i, name in enumerate(names)}
+
+# queries made only of words (or alternatives of words) are checked with a substring test on the lowercased unit;
+# that gives the same answer as the IGNORECASE search only for ASCII text, so other units still use the regex
+literalQuery = re.compile(r'^(?:\(\?:)?([\w &]+(?:\|[\w &]+)*)\)?$')
+literals = [tuple(word.lower() for word in found.group(1).split('|')) if found else None
+            for found in (literalQuery.match(query.pattern) for query in queries)]
+
+# prefilter of the other queries: the strings one of which is in every text a query matches, found in its parsed
+# pattern (a run of literal characters, small character classes and alternatives of those), the longest ones kept;
+# the regex only runs on the units that contain one of them, so the counts are the same
+# units are compared lowercased; foldTable first maps the characters IGNORECASE equates with an ASCII letter
+# but lower() does not, which is enough for the ASCII and Latin-1 characters the strings are made of
+foldTable = {0x130: "i", 0x131: "i", 0x17f: "s", 0x212a: "k"}
+maxAlternatives = 16
+maxClass = 4
+
+def exactStrings(items):
+    # the strings a parsed sequence matches when they are few and of fixed characters, otherwise None
+    strings = {""}
+    for item in items:
+        found = exactItem(item)
+        if found is None:
+            return None
+        strings = {a + b for a in strings for b in found}
+        if len(strings) > maxAlternatives:
+            return None
+    return strings
+
+def exactItem(item):
+    op, av = item
+    if op == sreParse.LITERAL:
+        return {chr(av).lower()} if chr(av) <= "\xff" else None
+    if op == sreParse.IN:
+        if len(av) <= maxClass and all(o == sreParse.LITERAL and chr(v) <= "\xff" for o, v in av):
+            return {chr(v).lower() for o, v in av}
+        return None
+    if op == sreParse.SUBPATTERN:
+        return exactStrings(av[-1])
+    if op == sreParse.BRANCH:
+        strings = set()
+        for alternative in av[1]:
+            found = exactStrings(alternative)
+            if found is None:
+                return None
+            strings |= found
+        return strings if len(strings) <= maxAlternatives else None
+    return None
+
+def better(a, b):
+    # the set with the longest shortest string, then with fewer strings
+    if a is None or b is None:
+        return a or b
+    return max(a, b, key=lambda strings: (min(map(len, strings)), -len(strings)))
+
+def requiredStrings(items):
+    # strings one of which is in every match of a parsed sequence, or None when none are found
+    best = None
+    run = {""}
+    for item in list(items) + [None]:
+        found = exactItem(item) if item else None
+        if found is not None:
+            extended = {a + b for a in run for b in found}
+            if len(extended) <= maxAlternatives:
+                run = extended
+                continue
+        if "" not in run:
+            best = better(best, run)
+        run = {""}
+        if found is not None:
+            run = found
+        elif item:
+            best = better(best, requiredItem(item))
+    return best
+
+def requiredItem(item):
+    op, av = item
+    if op == sreParse.SUBPATTERN:
+        return requiredStrings(av[-1])
+    if op == sreParse.BRANCH:
+        strings = set()
+        for alternative in av[1]:
+            found = requiredStrings(alternative)
+            if found is None:
+                return None
+            strings |= found
+        return strings
+    if op in (sreParse.MAX_REPEAT, sreParse.MIN_REPEAT) and av[0] >= 1:
+        return requiredStrings(av[2])
+    return None
+
+def withoutLonger(strings):
+    # a string containing another one of the set adds nothing to the test
+    return tuple(sorted(string for string in strings if not any(other != string and other in string for other in strings)))
+
+required = [withoutLonger(requiredStrings(sreParse.parse(query.pattern, query.flags)) or ()) for query in queries]
+
+materialIndexes = list(range(len(materialRules)))
+topicIndexes = list(range(len(materialRules), len(queries)))
+
+# the columns of the hit matrix of countMatches, and the ones summed into each topic column
+topicNames = [names[i] for i in topicIndexes]
+simpleColumns = [topicNames.index(name) for name, pattern in simpleRules]
+epcColumns = [topicNames.index(name + "_epc") for name, *rest in conceptRules]
+generalColumns = [topicNames.index(name + "_general") for name, *rest in conceptRules]
+pctColumns = [topicNames.index(name + "_pct") for name, *rest in conceptRules]
+
+def countMatches(onlyText, maxChars=None, deadline=None):
+    # walks each text unit once and returns whether each material rule matches any unit (1 or 0), and the hit matrix
+    # of the topic rules: a numpy bool array with a row for each unit whose topics were counted and a column for each
+    # topic query (topicNames), true where the query matches the unit
+    # material rules only need to know whether any unit matches, so they stop being searched after the first hit
+    # the topic rules stop being searched once maxChars characters have been counted, the last unit being cut to
+    # the characters left, or after the deadline (a time.perf_counter() value), checked before every unit; the cost
+    # is linear in the text size and bounded by these budgets
+    import numpy
+    materialHits = [0] * len(materialRules)
+    pendingMaterial = list(materialIndexes)
+    activeTopics = True
+    rows = []
+    characters = 0
+    for item in onlyText:
+        if activeTopics and ((maxChars is not None and characters >= maxChars) or
+                             (deadline is not None and time.perf_counter() > deadline)):
+            activeTopics = False
+        if not activeTopics and not pendingMaterial:
+            break
+        folded = fold(item)
+        if pendingMaterial:
+            for i in [i for i in pendingMaterial if ruleMatches(i, item, folded)]:
+                materialHits[i] = 1
+                pendingMaterial.remove(i)
+        if activeTopics:
+            if maxChars is not None and characters + len(item) > maxChars:
+                item = item[:maxChars - characters]
+                folded = fold(item)
+            characters += len(item)
+            rows.append([ruleMatches(i, item, folded) for i in topicIndexes])
+    return materialHits, numpy.array(rows, dtype=bool).reshape(len(rows), len(topicIndexes))
+
+def fold(item):
+    # the unit as compared with the literals and the required strings of ruleMatches
+    return item.lower() if item.isascii() else item.translate(foldTable).lower()
+
+def ruleMatches(i, item, folded):
+    # isascii is a flag of the string, not a scan
+    if literals[i] and item.isascii():
+        return any(word in folded for word in literals[i])
+    if required[i] and not any(word in folded for word in required[i]):
+        return False
+    return queries[i].search(item) is not None
+
+def typeOfMaterial(isPresentation, materialHits):
+    result = []
+    if isPresentation: result.append("Presentation|2dc089fb-8444-4cd3-a9ca-9fcc728aac7a; ")
+    for i, (label, pattern) in enumerate(materialRules):
+        if materialHits[i]: result.append(label)
+    return ''.join(result)
+
+def topicColumns(topicCounts, thresholdMatches):
+    # returns the values of fields[8:31] and the patent law references of fields[7] from the number of units
+    # each topic query matches, the column sums of the hit matrix (a numpy array)
+    epcCounts, pctCounts = topicCounts[epcColumns], topicCounts[pctColumns]
+    values = dict(zip([name for name, pattern in simpleRules], topicCounts[simpleColumns].tolist()))
+    values.update(zip([name for name, *rest in conceptRules], (epcCounts + topicCounts[generalColumns] + pctCounts).tolist()))
+    values["PCT"] += int(pctCounts.sum())
+    patentLawRef = ""
+    for (name, epc, general, pct, epcRef, pctRef), epcCount, pctCount in zip(conceptRules, epcCounts, pctCounts):
+        if epcCount > thresholdMatches:
+            patentLawRef = patentLawRef + epcRef
+        if pctCount > thresholdMatches:
+            patentLawRef = patentLawRef + pctRef
+    return [values[name] for name in columns], patentLawRef
+
+def titleConcepts(title):
+    # for each patent law concept, whether any of its queries matches the title
+    return [any(queries[rule[name + suffix]].search(title) for suffix in ("_epc", "_general", "_pct"))
+            for name, *rest in conceptRules]